@@ -6,7 +6,12 @@
 import urllib2
 #import urllib  # for python3
 import sys,argparse,os,tempfile
+from collections import deque
+from multiprocessing.pool import ThreadPool
 import xml.etree.ElementTree as ET
+# the shared PASTA modules are kept in the directory above this one
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import pastaClient
 
 DEBUG=0
 
@@ -27,6 +32,8 @@ urlList - lists metadata URLs for all data packages not currently in PASTA \n
 or where PASTA revisions are older than the current revision\n\
 urlListUpdate - lists metadata URLs for data packages already in PASTA, that have an older revision\n\
 urlListNew - lists metadata URLs for data packages not in PASTA, regardless of revision", required=False)
+parser.add_argument('--bulk','-b',action="store_true",default=False,dest='bulk',help="list the identifiers of each scope and the revisions of each identifier once, many at the same time, and compare the whole harvest list with them instead of checking each document in turn")
+parser.add_argument('--concurrency',type=int,default=20,dest='concurrency',help="largest number of requests to run at the same time. Default is 20")
 
 args=parser.parse_args()
 argList=vars(args)
@@ -50,66 +57,139 @@ harvestListUrlX.text=harvestListUrl
 
 # Get the harvest list to be compared
 harvestListReq=urllib2.Request(harvestListUrl)    
-harvestSock=urllib2.urlopen(harvestListReq,timeout=60)
-harvestListXml=harvestSock.read()
-if (DEBUG <> 0):
-    print(harvestListXml)
-
-# Fetch the scope, identifier and revision of data in the harvest list
-emlListRoot=ET.fromstring(harvestListXml)
-if (DEBUG <> 0):
-    print emlListRoot.tag
+harvestSock=pastaClient.urlopen(harvestListReq,timeout=60)
+
+## Functions for checking the documents of the harvest list
+# identifiers (or revisions) listed by PASTA at a url, empty if PASTA has none
+def readPastaList(pastaUrl):
+    if (DEBUG <> 0):
+        print(pastaUrl)
+    pastaReq=urllib2.Request(pastaUrl)   
+    try:
+        pastaSock=pastaClient.urlopen(pastaReq,timeout=60)
+        return(pastaSock.read().split())
+    except urllib2.HTTPError:
+        return([])
+
+def listIdentifiers(pastaScope):
+    return(readPastaList("http://pasta.lternet.edu/package/eml/"+pastaScope))
+
+def listRevisions(scopeId):
+    (pastaScope,pastaId)=scopeId
+    return(readPastaList("http://pasta.lternet.edu/package/eml/"+pastaScope+"/"+pastaId))
+
+# does PASTA have this revision? Only the HTTP status is requested, not the document
+def revisionExists(pastaScope,pastaId,pastaRev):
+    pastaUrl="http://pasta.lternet.edu/package/eml/"+pastaScope+"/"+pastaId+"/"+pastaRev 
+    pastaCode=pastaClient.status(pastaUrl,timeout=60)
+    if (DEBUG <> 0):
+        print(pastaUrl+" "+str(pastaCode))
+    return(pastaCode < 400)
+
+# The status of a harvest list document in PASTA. inPasta is
+# Current_revision_in_PASTA, Needs_upgrade or not_in_PASTA and currentRev
+# the most recent revision in PASTA (or none). revList is the list of
+# PASTA revisions of the identifier, if known
+def documentStatus(harvestDoc,revList):
+    (pastaScope,pastaId,pastaRev,emlUrl)=harvestDoc
+    docStatus={'packageId':pastaScope+"."+pastaId+"."+pastaRev,'emlUrl':emlUrl,'inPasta':"not_in_PASTA",'currentRev':"none"}
+    if pastaRev in revList:
+        docStatus['inPasta']="Current_revision_in_PASTA"
+        docStatus['currentRev']=pastaRev
+    elif revList:
+        docStatus['inPasta']="Needs_upgrade"
+        docStatus['currentRev']=revList[len(revList)-1]
+    return(docStatus)
+
+# status of a document from its own requests: a status-only check of the
+# revision and, if it isn't there, the revision list of the identifier
+def probeDocument(harvestDoc):
+    (pastaScope,pastaId,pastaRev,emlUrl)=harvestDoc
+    if revisionExists(pastaScope,pastaId,pastaRev):
+        return(documentStatus(harvestDoc,[pastaRev]))
+    # the url list holds all documents not current in PASTA, so there is no need to look further
+    if (outputType == 'urlList'): 
+        return(documentStatus(harvestDoc,[]))
+    return(documentStatus(harvestDoc,listRevisions((pastaScope,pastaId))))
+
+def reportDocument(docStatus):
+    inPasta=docStatus['inPasta']
+    emlUrl=docStatus['emlUrl']
+    if (inPasta == "Current_revision_in_PASTA"):
+        if (outputType == 'csv'):
+            print(docStatus['packageId']+","+inPasta+","+docStatus['currentRev']+","+emlUrl)
+    elif (outputType == 'urlList'):
+        print(emlUrl)
+    elif (inPasta == "Needs_upgrade"):
+        if (outputType == 'urlListUpdate'):
+            print(emlUrl)
+        elif (outputType == 'csv'):
+            print(docStatus['packageId']+","+inPasta+","+docStatus['currentRev']+","+emlUrl)
+    else:
+        if (outputType == 'urlListNew'):
+            print(emlUrl)
+        elif (outputType == 'csv'):
+            print(docStatus['packageId']+","+inPasta+",none,"+emlUrl)
+
+# Generates the scope, identifier, revision and url of each document in
+# the harvest list as it is read, keeping only one document in memory
+def readHarvestList(harvestSock):
+    emlListRoot=None
+    for (event,element) in ET.iterparse(harvestSock,events=('start','end')):
+        if emlListRoot is None:
+            emlListRoot=element
+            if (DEBUG <> 0):
+                print emlListRoot.tag
+        if event == 'end' and element.tag == 'document':
+            emlUrl=element.find('documentURL').text
+            for emlDoc in element.findall('docid'):
+                yield((emlDoc.find('scope').text,emlDoc.find('identifier').text,emlDoc.find('revision').text,emlUrl))
+            emlListRoot.clear()
+
+## For --bulk the identifiers of each scope and the revisions of each
+## identifier are only requested once, when they are first needed
+scopeIdArray={}
+revisionResults={}
+
+# start the check of a document. For --bulk the result is the revision list
+# of the identifier, or None if the scope doesn't have the identifier
+def checkDocument(harvestDoc):
+    if not argList['bulk']:
+        return(checkPool.apply_async(probeDocument,(harvestDoc,)))
+    (pastaScope,pastaId,pastaRev,emlUrl)=harvestDoc
+    # one request per scope, so it is made here rather than by the pool
+    if pastaScope not in scopeIdArray:
+        scopeIdArray[pastaScope]=set(listIdentifiers(pastaScope))
+    if pastaId not in scopeIdArray[pastaScope]:
+        return(None)
+    if (pastaScope,pastaId) not in revisionResults:
+        revisionResults[(pastaScope,pastaId)]=checkPool.apply_async(listRevisions,((pastaScope,pastaId),))
+    return(revisionResults[(pastaScope,pastaId)])
+
+# Report the documents at the front of the list whose checks are finished,
+# in harvest list order. Waits for the first document if more than
+# maxPending are still being checked, or for all of them if waitAll
+def reportPending(maxPending,waitAll=False):
+    while pendingDocs and (waitAll or len(pendingDocs) > maxPending or pendingDocs[0][1] is None or pendingDocs[0][1].ready()):
+        (harvestDoc,checkResult)=pendingDocs.popleft()
+        if checkResult is None:
+            reportDocument(documentStatus(harvestDoc,[]))
+        elif argList['bulk']:
+            reportDocument(documentStatus(harvestDoc,checkResult.get()))
+        else:
+            reportDocument(checkResult.get())
+        sys.stdout.flush()
 
 if (outputType=='csv'):
     print("packageId,pastaStatus,currentPastaRevision,emlUrl")
-# loop through the list 
-for emlDoc1 in emlListRoot.findall('document'):
-    emlUrl=emlDoc1.find('documentURL').text
-    for emlDoc in emlDoc1.findall('docid'):
-        pastaScope=emlDoc.find('scope').text
-        pastaId=emlDoc.find('identifier').text
-        pastaRev=emlDoc.find('revision').text
-
-        pastaUrl="http://pasta.lternet.edu/package/eml/"+pastaScope+"/"+pastaId+"/"+pastaRev 
-        if (DEBUG <> 0):
-            print(pastaUrl)
-        pastaReq=urllib2.Request(pastaUrl)   
-        try:
-            pastaSock=urllib2.urlopen(pastaReq,timeout=60)
-            pastaMsg=pastaSock.read()
-            if (DEBUG <> 0):
-                print(pastaMsg)
-            inPasta="Current_revision_in_PASTA"
-            if (outputType == 'csv'):
-                print(pastaScope+"."+pastaId+"."+pastaRev+","+inPasta+","+pastaRev+","+emlUrl)
-        except urllib2.HTTPError:
-            inPasta="not_in_PASTA"
-            if (outputType == 'urlList'): 
-                print(emlUrl)
-            else:
-                pastaUrl="http://pasta.lternet.edu/package/eml/"+pastaScope+"/"+pastaId
-                pastaReq=urllib2.Request(pastaUrl)   
-                try:
-                    pastaSock=urllib2.urlopen(pastaReq,timeout=60)
-                    pastaMsg=pastaSock.read()
-                    revList=pastaMsg.split()
-                    currentRev=revList[len(revList)-1]
-                    inPasta="Needs_upgrade"
-                    if (outputType == 'urlListUpdate'):
-                        print(emlUrl)
-                    elif (outputType == 'csv'):
-                        print(pastaScope+"."+pastaId+"."+pastaRev+","+inPasta+","+currentRev+","+emlUrl)
-                except urllib2.HTTPError:
-                    if (outputType == 'urlListNew'):
-                        print(emlUrl)
-                    elif (outputType == 'csv'):
-                        print(pastaScope+"."+pastaId+"."+pastaRev+","+inPasta+",none,"+emlUrl)
-
-
-
-
-
-
-    
-
-
+# each document is checked as soon as it is read from the harvest list,
+# up to --concurrency at the same time
+pastaClient.defaultClient.poolSize=argList['concurrency']
+checkPool=ThreadPool(argList['concurrency'])
+pendingDocs=deque()
+for harvestDoc in readHarvestList(harvestSock):
+    pendingDocs.append((harvestDoc,checkDocument(harvestDoc)))
+    reportPending(argList['concurrency']*4)
+reportPending(0,True)
+checkPool.close()
+checkPool.join()
@@ -5,16 +5,32 @@
 
 import urllib2
 #import urllib  # for python3
-import sys,argparse,os,tempfile
+import sys,argparse,os,itertools,multiprocessing,socket
 from datetime import datetime,timedelta,time
 import xml.etree.ElementTree as ET
 import lxml.etree as XSLT_ET
-from getpass import getpass
+from multiprocessing.pool import ThreadPool
+from collections import deque
+from getpass import getpass,getuser
+# the shared PASTA modules are kept in the directory above this one
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import pastaClient
+import pastaAudit
+import pastaCache
+import pastaHarvest
+import pastaMail
+import pastaStats
+import pastaJournal
+import pastaPlan
+import pastaDocument
 
 DEBUG=0
 
-# Give the path to your email program with options prior to who to send it to....
-emailCmd='/bin/mailx -s "PASTA Download Report"  '
+# Give the SMTP server (host or host:port) used to send the reports and the
+# address they are sent from
+smtpServer='localhost'
+emailFrom=getuser()+'@'+socket.getfqdn()
+emailSubject="PASTA Download Report"
 
 styleSheetNameHTML='/home/jhp7e/src/python/PASTAsummary2.xsl'
 
@@ -41,8 +57,24 @@ parser.add_argument('--createdir','-d',dest='createDir',default='',type=str,help
 parser.add_argument('--maillist','-m',dest='mailList',default='',type=str,help="specify file to read email addresses (one per line) to be used for sending reports")
 parser.add_argument('--genmaillist','-g',dest='genMailList',default='',type=str,help="generate a mailing list from contacts, specify file where contact email addresses will be stored. No other outputs will be produced.")
 parser.add_argument('--quiet','-q',action="store_false",default='store_true',help="suppress messages during processing")
+parser.add_argument('--cache','-k',type=str,default='',dest='cacheFile',help='name of a file in which to keep package metadata between runs, e.g. pastaCache.sqlite')
+parser.add_argument('--cachesize',type=int,default=pastaCache.defaultCacheSize,dest='cacheSize',help='largest size of the package metadata cache in megabytes. Default is '+str(pastaCache.defaultCacheSize))
+parser.add_argument('--auditstore','-s',type=str,default='',dest='auditStore',help="name of a file in which to keep the audit records of the scope between runs, e.g. pastaAudit.sqlite. Only records newer than those already in the file are requested")
+parser.add_argument('--async',action="store_true",default=False,dest='asyncWalk',help="run many requests at the same time, starting each one as soon as what it depends on is finished")
+parser.add_argument('--concurrency',type=int,default=50,dest='concurrency',help="largest number of requests to run at the same time with --async or --genmaillist. Default is 50")
+parser.add_argument('--bulkaudit','-b',action="store_true",default=False,dest='bulkAudit',help="harvest the audit records for the whole scope in a few large requests instead of one request per package and entity")
+parser.add_argument('--workers','-w',type=int,default=1,dest='workers',help="number of processes rendering contact reports at the same time. Default is 1 (one at a time)")
+parser.add_argument('--smtpserver',type=str,default=smtpServer,dest='smtpServer',help="SMTP server (host or host:port) used with --create email. Default is "+smtpServer)
+parser.add_argument('--mailfrom',type=str,default=emailFrom,dest='emailFrom',help="address the reports are sent from with --create email. Default is "+emailFrom)
+parser.add_argument('--mailconnections',type=int,default=2,dest='mailConnections',help="number of SMTP connections sending reports at the same time with --create email. Default is 2")
+parser.add_argument('--stats',type=str,default='',dest='statsFile',help="name of a file in which to write the number, times and sizes of the requests to each kind of PASTA endpoint and the time of each step of the run as JSON, or - for stderr")
+parser.add_argument('--journal','-j',type=str,default='',dest='journalFile',help="name of a file in which to record each package revision as it is finished, e.g. pastaJournal.sqlite, so that a run that stops can be continued with --resume")
+parser.add_argument('--resume',action="store_true",default=False,dest='resume',help="continue the run recorded in the --journal file. Revisions already in it are not requested again")
+parser.add_argument('--skipinactive',action="store_true",default=False,dest='skipInactive',help="report only the package revisions with audit records in the period, found from one harvest of the audit records of the scope (as with --bulkaudit, or from the --auditstore file). The others are listed under skippedPackages in the XML")
 
 args=parser.parse_args()
+if args.resume and args.journalFile == '':
+    parser.error("--resume needs the --journal file of the run to continue")
 argList=vars(args)
 pastaScope=argList['PASTAscope']
 # set or get username and password or authorization file
@@ -86,8 +118,31 @@ else:
     pastaRev=''
 pastaFromTime=argList['pastaFromTime']
 pastaToTime=argList['pastaToTime']
+# a resumed run covers the period of the run it continues unless dates are given
+if argList['resume']:
+    journalParameters=pastaJournal.savedParameters(argList['journalFile'])
+    if journalParameters is not None:
+        if pastaFromTime == parser.get_default('pastaFromTime'):
+            pastaFromTime=journalParameters['pastaFromTime']
+        if pastaToTime == parser.get_default('pastaToTime'):
+            pastaToTime=journalParameters['pastaToTime']
+if argList['cacheFile'] != '':
+    packageCache=pastaCache.PackageCache(argList['cacheFile'],argList['cacheSize'])
+else:
+    packageCache=None
 genMailList=argList['genMailList']
 mailList=argList['mailList']
+runJournal=None
+if argList['journalFile'] != '':
+    runParameters={'script':'PASTAsummary.py','pastaScope':pastaScope,'pastaFromTime':pastaFromTime,'pastaToTime':pastaToTime,
+                   'identifier':pastaId,'revision':pastaRev}
+    try:
+        runJournal=pastaJournal.RunJournal(argList['journalFile'],runParameters,argList['resume'])
+    except ValueError,e:
+        sys.stderr.write(str(e)+"\n")
+        sys.exit(1)
+    if args.quiet and argList['resume']:
+        sys.stderr.write("resuming with "+str(runJournal.resumedCount)+" package revisions from "+argList['journalFile']+"\n")
 
 
 ##if len(sys.argv) > 1:
@@ -107,93 +162,44 @@ mailList=argList['mailList']
 def metadataUseCount(pastaScope,pastaId,pastaVersion):
     pastaUrl="http://pasta.lternet.edu/audit/report"
     pastaResource="https://pasta.lternet.edu/package/metadata/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)
- 
-    if pastaToTime == '':
-    #    pastaToTime=datetime.today().strftime("%Y-%m-%dT%H:%M:%S")
-    #    print pastaToTime
-        pastaQueryString=pastaUrl+'/?resourceId='+pastaResource+'&fromTime='+pastaFromTime
-    else:
-            pastaQueryString=pastaUrl+'/?resourceId='+pastaResource+'&fromTime='+pastaFromTime+'&toTime='+pastaToTime
+    # fromTime and toTime are added for each shard of the period
+    pastaQueryString=pastaUrl+'/?resourceId='+pastaResource
     if DEBUG:
         print(pastaQueryString)
-    req=urllib2.Request(pastaQueryString)
     #req=urllib2.Request('https://pasta.lternet.edu/audit/report/?resourceId=https://pasta.lternet.edu/package/data/eml/knb-lter-vcr/26/15/VCR97019&fromTime=2012-09-01T00:00:00')
-
-    req.add_header('Authorization', userData)
-
-    usock=urllib2.urlopen(req,timeout=160)
-    if(DEBUG==1):
-        print("\nMETADATA ------------")
-        print("url: "+str(usock.geturl()))
-        print("HTML return code: "+str(usock.getcode()))
-        print(usock.info())
-        print(usock.readlines())
-        usock.close()
-        usock=urllib2.urlopen(req,timeout=160)
-        
-    xmlTree = ET.parse(usock)
-    xmlRoot=xmlTree.getroot()
-    auditRecords=xmlRoot.findall('.//auditRecord')
-    return(len(auditRecords))
-## uncomment this to print out list of metadata downloads
+    return(pastaAudit.shardedAuditCounts(pastaQueryString,pastaFromTime,pastaToTime,userData,pastaAudit.countRecords,pastaAudit.addCounts))
+## to print out list of metadata downloads use this as the tally
+##    def printRecords(auditRecords):
 ##        for nodeA in auditRecords:
 ##            print("Metadata Download: "+nodeA.find('./entryTime').text+" user "+nodeA.find('./user').text)
 ##        
 
-def entityReport(pastaScope,pastaId,pastaVersion,pastaEntity):
+def entityAuditCounts(pastaScope,pastaId,pastaVersion,pastaEntity):
     pastaUrl="http://pasta.lternet.edu/audit/report"
     pastaResource="https://pasta.lternet.edu/package/data/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)+"/"+pastaEntity
     #print pastaResource
-
-    if pastaToTime == '':
-    #    pastaToTime=datetime.today().strftime("%Y-%m-%dT%H:%M:%S")
-    #    print pastaToTime
-        pastaQueryString=pastaUrl+'/?serviceMethod=readDataEntity&resourceId='+pastaResource+'&fromTime='+pastaFromTime
-    else:
-            pastaQueryString=pastaUrl+'/?serviceMethod=readDataEntity&resourceId='+pastaResource+'&fromTime='+pastaFromTime+'&toTime='+pastaToTime
+    # fromTime and toTime are added for each shard of the period
+    pastaQueryString=pastaUrl+'/?serviceMethod=readDataEntity&resourceId='+pastaResource
     if DEBUG:
         print(pastaQueryString)
 
-    req=urllib2.Request(pastaQueryString)
-        
-    req.add_header('Authorization', userData)
-
     try:
-        usock=urllib2.urlopen(req)
-        if(DEBUG==1):
-            print("\nDATA ------------")
-            print("url: "+str(usock.geturl()))
-            print("HTML return code: "+str(usock.getcode()))
-            print(usock.info())
-            print(usock.readlines())
-            usock.close()
-            usock=urllib2.urlopen(req,timeout=160)
-    except:
-        entityDownloadCountX=ET.SubElement(entitiesX,"entityDownloadCount")
-        entityDownloadCountX.text="0"
-        return(0)
-    #print raw XML output for debug
-    #print(usock.read())
-    xmlTree = ET.parse(usock)
-    xmlRoot=xmlTree.getroot()
-    blist=xmlRoot.findall('.//auditRecord')
-    #print(blist)
+        return(pastaAudit.shardedAuditCounts(pastaQueryString,pastaFromTime,pastaToTime,userData,pastaAudit.tallyEntityRecords,pastaAudit.mergeEntityCounts))
+    except (socket.error,urllib2.URLError),e:
+        sys.stderr.write("audit report failed for "+pastaResource+" ("+str(e)+") - download count unknown\n")
+        return(None)
+
+# add the counts from entityAuditCounts to the entity XML and return the
+# number of successful downloads, or None if the audit report failed
+def addEntityCounts(entityX,entityCounts):
+    if entityCounts is None:
+        entityDownloadCountX=ET.SubElement(entityX,"entityDownloadCount")
+        entityDownloadCountX.text="unknown"
+        return(None)
+    (recordCount,myCount,userArray)=entityCounts
     entityDownloadCountX=ET.SubElement(entityX,"entityDownloadCount")
-    entityDownloadCountX.text=str(len(blist))
-    #print("Number of Downloads: "+str(len(blist)))
-    myCount=0
-    userArray={'public':0}
-    for b in blist:
-        responseStatus=b.find('./responseStatus').text
-        user=b.find('./user').text
-# only count if download didn't fail with 401 code
-        if responseStatus != '401':
-            myCount=myCount+1
-            if user in userArray:
-                userArray[user]=userArray[user]+1
-            else:
-                userArray[user]=1
-    #print("myCount= "+str(myCount)+"\n")
+    entityDownloadCountX.text=str(recordCount)
+    #print("Number of Downloads: "+str(recordCount))
     sortedUsers= sorted(userArray.keys(),key=lambda i: userArray[i])
     sortedUsers.reverse()
     entityUserCountX=ET.SubElement(entityX,"entityUserCount")
@@ -216,104 +222,296 @@ if mailList <> '':
     fIn=open(mailList,'r')
     inMailList=fIn.read().splitlines()
     fIn.close()
-# create output ElementTree XML structure
-xRoot=ET.Element('pastaSummaries')
-fromTimeX=ET.SubElement(xRoot,"fromTime")
-fromTimeX.text=pastaFromTime
-toTimeX=ET.SubElement(xRoot,"toTime")
-toTimeX.text=pastaToTime
+scopeAudit=None
+# answer all the audit questions from one harvest of the whole scope.
+# A mailing list only needs the contacts, so no audit records are used for it
+if genMailList <> '':
+    pass
+elif argList['auditStore'] != '':
+    if args.quiet:
+        sys.stderr.write("updating audit records for scope: "+pastaScope+" in "+argList['auditStore']+"\n")
+    with pastaStats.phase('audit'):
+        scopeAudit=pastaAudit.AuditStore(argList['auditStore'],pastaScope,pastaFromTime,pastaToTime,userData).harvest()
+elif argList['bulkAudit'] or argList['skipInactive']:
+    if args.quiet:
+        sys.stderr.write("harvesting audit records for scope: "+pastaScope+"\n")
+    with pastaStats.phase('audit'):
+        scopeAudit=pastaAudit.ScopeAudit(pastaScope,pastaFromTime,pastaToTime,userData).harvest()
+if scopeAudit is not None:
+    metadataUseCount=scopeAudit.metadataUseCount
+    entityAuditCounts=scopeAudit.entityAuditCounts
+revisionPlan=None
+if argList['skipInactive'] and scopeAudit is not None:
+    revisionPlan=pastaPlan.RevisionPlan(pastaScope,scopeAudit.activeRevisions())
+# create the output XML document. Each pastaSummary is written to a file
+# as soon as its package is finished, so the scope is not kept in memory
+summaryDocument=pastaDocument.SummaryDocument(pastaFromTime,pastaToTime)
 
 if pastaId == '':
     pastaUrl="http://pasta.lternet.edu/package/eml/"+pastaScope                      
     pastaReq=urllib2.Request(pastaUrl)    
     pastaReq.add_header('Authorization', userData)
-    pastaSock=urllib2.urlopen(pastaReq,timeout=60)
-    pastaIds=pastaSock.read()
+    with pastaStats.phase('listing'):
+        pastaSock=pastaClient.urlopen(pastaReq,timeout=60)
+        pastaIds=pastaSock.read()
 else:
     pastaIds=pastaId
     #print pastaString
 
+## Functions for each step of the walk through the packages
+def listVersions(pastaScope,pastaId):
+    if pastaRev != '':
+        return([pastaRev])
+    pastaUrl="http://pasta.lternet.edu/package/eml/"+pastaScope+"/"+pastaId                      
+    pastaReq=urllib2.Request(pastaUrl)    
+    pastaReq.add_header('Authorization', userData)
+    pastaSock=pastaClient.urlopen(pastaReq,timeout=60)
+    #produce a list of versions
+    pastaVersions=pastaSock.read().split()
+    # most recent version first so reverse order of versions
+    pastaVersions.reverse()
+    return(pastaVersions)
+
+# the most recent revision of an identifier
+def latestVersion(pastaScope,pastaId):
+    if pastaRev != '':
+        return(pastaRev)
+    pastaUrl="http://pasta.lternet.edu/package/eml/"+pastaScope+"/"+pastaId+"?filter=newest"
+    pastaReq=urllib2.Request(pastaUrl)    
+    pastaReq.add_header('Authorization', userData)
+    pastaSock=pastaClient.urlopen(pastaReq,timeout=60)
+    return(pastaSock.read().strip())
+
+# contacts of the most recent revision of an identifier, for --genmaillist
+def identifierContacts(pastaId):
+    pastaVersion=latestVersion(pastaScope,pastaId)
+    if args.quiet:
+         sys.stderr.write("reading contacts: "+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)+"\n")
+    return(pastaCache.packageContacts(pastaScope,pastaId,pastaVersion,userData,packageCache))
+
+# revisions of an identifier with a contact in the --maillist. The
+# stylesheet matches contacts with contains(), so the same test is used here
+def recipientVersions(pastaId):
+    recipientVersionList=[]
+    for pastaVersion in listVersions(pastaScope,pastaId):
+        for contactEmail in pastaCache.packageContacts(pastaScope,pastaId,pastaVersion,userData,packageCache):
+            if contactEmail != "tech-support@lternet.edu" and [recipient for recipient in inMailList if recipient in contactEmail]:
+                recipientVersionList.append(pastaVersion)
+                break
+    return(recipientVersionList)
+
+def plannedVersions(pastaScope,pastaId):
+    return(recipientVersionArray[pastaId])
+
+def loadPackage(pastaScope,pastaId,pastaVersion):
+    if args.quiet:
+         sys.stderr.write("processing package: "+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)+"\n")
+    # Get the data package metadata to extract dataset title and entities
+    return(pastaCache.packageInfo(pastaScope,pastaId,pastaVersion,userData,packageCache))
+
+# fetch everything for one package revision, one request at a time
+def packageSummary(pastaScope,pastaId,pastaVersion):
+    packageData=loadPackage(pastaScope,pastaId,pastaVersion)
+    return({'pastaId':pastaId,
+            'pastaVersion':pastaVersion,
+            'packageData':packageData,
+            'metadataDownloadCount':metadataUseCount(pastaScope,pastaId,pastaVersion),
+            'entityCounts':[entityAuditCounts(pastaScope,pastaId,pastaVersion,pastaEntity) for (entityName,pastaEntity) in packageData['entities']]})
+
+# package summary from the journal, or fetched and recorded in it. Only
+# what the report uses is kept, not the EML itself
+def journaledSummary(pastaScope,pastaId,pastaVersion):
+    if runJournal is None:
+        return(packageSummary(pastaScope,pastaId,pastaVersion))
+    packageResult=runJournal.get(pastaId,pastaVersion)
+    if packageResult is None:
+        packageResult=packageSummary(pastaScope,pastaId,pastaVersion)
+        recordSummary(packageResult)
+    return(packageResult)
+
+# A result with a failed audit report (a count of None) is not recorded,
+# so that a resumed run asks for it again
+def recordSummary(packageResult):
+    if packageResult['metadataDownloadCount'] is None or None in packageResult['entityCounts']:
+        return
+    packageData=packageResult['packageData']
+    runJournal.put(packageResult['pastaId'],packageResult['pastaVersion'],
+                   {'pastaId':packageResult['pastaId'],
+                    'pastaVersion':packageResult['pastaVersion'],
+                    'packageData':{'title':packageData['title'],'contacts':packageData['contacts'],'entities':packageData['entities']},
+                    'metadataDownloadCount':packageResult['metadataDownloadCount'],
+                    'entityCounts':packageResult['entityCounts']})
+
+# add the pastaSummary for one package revision to the output XML
+def addPackageSummary(packageResult):
+    pastaId=packageResult['pastaId']
+    pastaVersion=packageResult['pastaVersion']
+    packageData=packageResult['packageData']
+    # an audit store keeps the title and entities too, for PastaUseCountQuery.py
+    if scopeAudit is not None:
+        scopeAudit.addPackage(pastaId,pastaVersion,packageData)
+    pastaSummaryX=ET.Element("pastaSummary")
+    packageIdX=ET.SubElement(pastaSummaryX,"packageId")
+    packageIdX.text=pastaScope+"."+str(pastaId)+"."+str(pastaVersion)
+    titleX=ET.SubElement(pastaSummaryX,"title")
+    titleX.text=packageData['title']
+    contactsX=ET.SubElement(pastaSummaryX,"contacts")
+    summaryNumber=summaryDocument.elementCount()
+ 
+    contactEmails=packageData['contacts']
+    contactNumber=0
+    for contactEmail in contactEmails:
+        if contactEmail != "tech-support@lternet.edu":
+            contactX=ET.SubElement(contactsX,"contact")
+            electronicMailAddressX=ET.SubElement(contactX,"electronicMailAddress>")
+            electronicMailAddressX.text=contactEmail
+            contactEmailArray[contactEmail]=1
+            # index of the packages each contact is listed for
+            contactSummaries=contactIndex.setdefault(contactEmail,[])
+            if summaryNumber not in contactSummaries:
+                contactSummaries.append(summaryNumber)
+        contactNumber=contactNumber+1
+
+    #print contactEmails
+    
+    metadataDownloadCountX=ET.SubElement(pastaSummaryX,"metadataDownloadCount")
+    metadataDownloadCountX.text=str(packageResult['metadataDownloadCount'])
+    entitiesX=ET.SubElement(pastaSummaryX,"entities")
+    dataDownloadTotalCount=0
+    entityNumber=0
+    for (entityName,pastaEntity) in packageData['entities']:
+        entityX=ET.SubElement(entitiesX,"entity")
+        entityNameX=ET.SubElement(entityX,"entityName")
+        entityNameX.text=entityName
+        entityIdX=ET.SubElement(entityX,"entityId")
+        entityIdX.text=pastaEntity
+        #print("\nEntity",entityName)
+        dataDownloadCount=addEntityCounts(entityX,packageResult['entityCounts'][entityNumber])
+        # the total is unknown if the count of any entity is
+        if dataDownloadCount is None or dataDownloadTotalCount is None:
+            dataDownloadTotalCount=None
+        else:
+            dataDownloadTotalCount=dataDownloadTotalCount+dataDownloadCount
+        entityNumber=entityNumber+1
+    dataDownloadTotalCountX=ET.SubElement(pastaSummaryX,"dataDownloadTotalCount")
+    if dataDownloadTotalCount is None:
+        dataDownloadTotalCountX.text="unknown"
+    else:
+        dataDownloadTotalCountX.text=str(dataDownloadTotalCount)
+    summaryDocument.add(pastaSummaryX)
+
+# build the XML holding only the packages of one contact. The stylesheet
+# picks packages with contains(electronicMailAddress,$contactEmail), so
+# the packages of every contact address containing contactEmail are used
+def contactDocument(contactEmail):
+    summaryNumbers=set()
+    for indexEmail in contactIndex.keys():
+        if contactEmail in indexEmail:
+            summaryNumbers.update(contactIndex[indexEmail])
+    return(summaryDocument.subDocument(sorted(summaryNumbers)))
+
+## Contact reports can be rendered by a pool of worker processes (--workers),
+## each with its own compiled copy of the stylesheet
+renderTransform=None
+
+def startRenderer():
+    global renderTransform
+    renderTransform=XSLT_ET.XSLT(XSLT_ET.parse(styleSheetNameHTML))
+
+# transform the XML of one contact. The HTML is written to fileName if one
+# is given, otherwise it is returned
+def renderContact(contactReport):
+    (contactEmail,contactXml,fileName)=contactReport
+    newdom=renderTransform(XSLT_ET.fromstring(contactXml),contactEmail="'"+contactEmail+"'")
+    htmlString=XSLT_ET.tostring(newdom,pretty_print=True)
+    if fileName is None:
+        return(htmlString)
+    fileOut=open(fileName,mode='w')
+    fileOut.write(str(htmlString))
+    fileOut.close()
+    return(None)
+
+# Like pool.imap, but with no more than maxPending reports handed to the
+# workers and not yet used at any time. pool.imap takes everything from its
+# iterator at once, which would build the XML of every contact up front
+def boundedImap(pool,function,items,maxPending):
+    pendingResults=deque()
+    for item in items:
+        pendingResults.append(pool.apply_async(function,(item,)))
+        if len(pendingResults) >= maxPending:
+            yield(pendingResults.popleft().get())
+    while len(pendingResults) > 0:
+        yield(pendingResults.popleft().get())
+
 # set up a list to hold contact emails    
 contactEmailArray={}   
-for pastaId in pastaIds.split():
-    if pastaRev == '':
-        pastaUrl="http://pasta.lternet.edu/package/eml/"+pastaScope+"/"+pastaId                      
-        pastaReq=urllib2.Request(pastaUrl)    
-        pastaReq.add_header('Authorization', userData)
-        pastaSock=urllib2.urlopen(pastaReq,timeout=60)
-        #produce a list of versions
-        pastaVersions=pastaSock.read().split()
-        # most recent version first so reverse order of versions
-        pastaVersions.reverse()
-    else:
-        pastaVersions=[pastaRev]
-    for pastaVersion in pastaVersions:
-        pastaSummaryX=ET.SubElement(xRoot,"pastaSummary")    
-        if args.quiet:
-             sys.stderr.write("processing package: "+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)+"\n")
-        # Get the data package metadata to extract dataset title and entities
-        # liburl2 truncates downloaded data at 32768 bytes if HTTPS used 
-        emlUrl="http://pasta.lternet.edu/package/metadata/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)
-        emlReq=urllib2.Request(emlUrl)
-        emlReq.add_header('Authorization', userData)
-        emlSock=urllib2.urlopen(emlReq,timeout=60)
-        emlString=emlSock.read()
-        if(DEBUG==1):
-            print("url: "+str(emlSock.geturl()))
-            print("HTML return code: "+str(emlSock.getcode()))
-            print(emlSock.info())
-            print(emlString)
-        emlRoot=ET.fromstring(emlString)
-        packageIdX=ET.SubElement(pastaSummaryX,"packageId")
-        packageIdX.text=pastaScope+"."+str(pastaId)+"."+str(pastaVersion)
-        titleX=ET.SubElement(pastaSummaryX,"title")
-        titleX.text=emlRoot.find('./dataset/title').text
-        contactsX=ET.SubElement(pastaSummaryX,"contacts")
- 
-        contactEmails=emlRoot.findall('./dataset/contact/electronicMailAddress')
-        contactNumber=0
+# for each contact email, the numbers of their pastaSummary elements in summaryDocument
+contactIndex={}
+if runJournal is not None:
+    listVersions=runJournal.journaledVersions(listVersions)
+# revisions without audit records in the period are left out of the walk,
+# and identifiers without any are not even listed
+if revisionPlan is not None:
+    listVersions=revisionPlan.plannedVersions(listVersions)
+# with --maillist only the packages of the recipients are reported, so the
+# contacts are read first and the other packages are left out of the walk
+if mailList <> '' and genMailList == '' and argList['argOutputType']=='html':
+    if args.quiet:
+        sys.stderr.write("finding the packages of the "+str(len(inMailList))+" recipients\n")
+    pastaClient.defaultClient.poolSize=argList['concurrency']
+    planPool=ThreadPool(argList['concurrency'])
+    recipientVersionArray={}
+    recipientIds=[]
+    for (pastaId,pastaVersions) in zip(pastaIds.split(),planPool.imap(pastaStats.timed('metadata',recipientVersions),pastaIds.split())):
+        if pastaVersions:
+            recipientVersionArray[pastaId]=pastaVersions
+            recipientIds.append(pastaId)
+    planPool.close()
+    planPool.join()
+    pastaIds=' '.join(recipientIds)
+    listVersions=plannedVersions
+# time each step of the walk. With --async the steps of many packages run
+# at once, so their seconds are summed over the threads
+listVersions=pastaStats.timed('listing',listVersions)
+loadPackage=pastaStats.timed('metadata',loadPackage)
+metadataUseCount=pastaStats.timed('audit',metadataUseCount)
+entityAuditCounts=pastaStats.timed('audit',entityAuditCounts)
+walkTimer=pastaStats.phase('walk').start()
+if genMailList <> '':
+    # only the EML of the latest revisions is read, many at the same time
+    pastaClient.defaultClient.poolSize=argList['concurrency']
+    contactPool=ThreadPool(argList['concurrency'])
+    for contactEmails in contactPool.imap_unordered(pastaStats.timed('metadata',identifierContacts),pastaIds.split()):
         for contactEmail in contactEmails:
-            if contactEmail.text != "tech-support@lternet.edu":
-                contactX=ET.SubElement(contactsX,"contact")
-                electronicMailAddressX=ET.SubElement(contactX,"electronicMailAddress>")
-                electronicMailAddressX.text=contactEmail.text
-                contactEmailArray[contactEmail.text]=1
-            contactNumber=contactNumber+1
-
-        #print contactEmails
-        
-        #print(emlString)
-    # Set up a list of entity names for use later
-        entityRecords=emlRoot.findall('.//entityName')
-        ##print("contains "+str(len(entityRecords))+" data entities");
-        ##for entityRecord in entityRecords:
-        ##    print(entityRecord.text)
-        metadataDownloadCountX=ET.SubElement(pastaSummaryX,"metadataDownloadCount")
-        metadataDownloadCountX.text=str(metadataUseCount(pastaScope,pastaId,pastaVersion))
-        entityCounter=0
-        pastaUrl="http://pasta.lternet.edu/package/data/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)
-        #print(pastaUrl)
-        req1=urllib2.Request(pastaUrl)
-        req1.add_header('Authorization', userData)
-        usock=urllib2.urlopen(req1)
-        pastaEntitiesId=usock.read()
-        entitiesX=ET.SubElement(pastaSummaryX,"entities")
-        dataDownloadTotalCount=0
-        for pastaEntity in pastaEntitiesId.split():
-            entityX=ET.SubElement(entitiesX,"entity")
-            entityName=entityRecords[entityCounter].text
-            entityNameX=ET.SubElement(entityX,"entityName")
-            entityNameX.text=entityName
-            entityIdX=ET.SubElement(entityX,"entityId")
-            entityIdX.text=pastaEntity
-            entityCounter=entityCounter+1
-            #print("\nEntity",entityCounter,entityName)
-            dataDownloadTotalCount=dataDownloadTotalCount+entityReport(pastaScope,pastaId,pastaVersion,pastaEntity)
-        dataDownloadTotalCountX=ET.SubElement(pastaSummaryX,"dataDownloadTotalCount")
-        dataDownloadTotalCountX.text=str(dataDownloadTotalCount)        
-xTree=ET.ElementTree(xRoot)
-xString=ET.tostring(xRoot)
-xml1=XSLT_ET.fromstring(xString)
+            if contactEmail != "tech-support@lternet.edu":
+                contactEmailArray[contactEmail]=1
+    contactPool.close()
+    contactPool.join()
+elif argList['asyncWalk']:
+    pastaClient.defaultClient.poolSize=argList['concurrency']
+    savedResult=None
+    if runJournal is not None:
+        savedResult=runJournal.get
+    packageWalk=pastaHarvest.PackageWalk(argList['concurrency'],listVersions,loadPackage,metadataUseCount,entityAuditCounts,savedResult)
+    for packageResult in packageWalk.walk(pastaScope,pastaIds.split()):
+        if runJournal is not None:
+            recordSummary(packageResult)
+        addPackageSummary(packageResult)
+else:
+    for pastaId in pastaIds.split():
+        for pastaVersion in listVersions(pastaScope,pastaId):
+            addPackageSummary(journaledSummary(pastaScope,pastaId,pastaVersion))
+walkTimer.stop()
+if revisionPlan is not None:
+    skippedPackagesX=ET.Element("skippedPackages")
+    for packageId in revisionPlan.skippedPackageIds():
+        packageIdX=ET.SubElement(skippedPackagesX,"packageId")
+        packageIdX.text=packageId
+    summaryDocument.add(skippedPackagesX)
+    pastaStats.addSection('plan',revisionPlan.summary())
+    if args.quiet:
+        sys.stderr.write(revisionPlan.summaryMessage())
+summaryDocument.finish()
 if genMailList <> '':
     fOut=open(genMailList,'w')
     contactEmailList=sorted(contactEmailArray.keys())
@@ -324,9 +522,11 @@ if genMailList <> '':
         sys.stderr.write("List of contact emails written to "+genMailList+"\n")
 else:    
     if argList['argOutputType']=='xml':
-        print(xString)
+        summaryDocument.copyTo(sys.stdout)
+        print("")
     else:
-        xslt=XSLT_ET.parse(styleSheetNameHTML)
+        # compile the stylesheet once for all the contacts
+        startRenderer()
         contactEmailList=sorted(contactEmailArray.keys())
         if mailList <> '':
             contactEmailList=inMailList
@@ -338,41 +538,46 @@ else:
             else:
                 outDirName=argList['createDir']
             os.mkdir(outDirName)
-        for contactEmail in contactEmailList:
-            if args.quiet:
-                sys.stderr.write("processing "+contactEmail+"\n")
+        # contact email, contact XML and output file name of each report
+        def contactReports():
+            for contactEmail in contactEmailList:
+                if args.quiet:
+                    sys.stderr.write("processing "+contactEmail+"\n")
+                contactFileName=None
+                if argList['createType']=='directory' :
+                    contactEmailStripped=contactEmail.strip()    # get rid of leading and trailing spaces
+                    contactFileName=outDirName+"/"+contactEmailStripped.replace("@","_at_")+".html"
+                yield((contactEmail,contactDocument(contactEmail),contactFileName))
+        if argList['workers'] > 1:
+            renderPool=multiprocessing.Pool(argList['workers'],startRenderer)
+            # the reports come back in the order of the contacts, and only a
+            # few contact documents are built ahead of the workers
+            renderedReports=boundedImap(renderPool,renderContact,contactReports(),argList['workers']*2)
+        else:
+            renderPool=None
+            renderedReports=itertools.imap(renderContact,contactReports())
+        if argList['createType']=='email' :
+            mailSender=pastaMail.MailSender(argList['smtpServer'],argList['mailConnections'])
+        # with --create email the reports are sent while the later ones are
+        # rendered, so render includes any wait for the mail queue
+        renderTimer=pastaStats.phase('render').start()
+        for (contactEmail,htmlString) in itertools.izip(contactEmailList,renderedReports):
             if argList['createType']=='list' :
-                transform=XSLT_ET.XSLT(xslt)
-                newdom=transform(xml1,contactEmail="'"+contactEmail+"'")
-                print(XSLT_ET.tostring(newdom,pretty_print=True))
-            if argList['createType']=='directory' :
-                contactEmailStripped=contactEmail.strip()    # get rid of leading and trailing spaces
-                contactFileName=contactEmailStripped.replace("@","_at_")+".html"
-                fileOut=open(outDirName+"/"+contactFileName,mode='w')
-                transform=XSLT_ET.XSLT(xslt)
-                newdom=transform(xml1,contactEmail="'"+contactEmail+"'")
-                fileOut.write(str(XSLT_ET.tostring(newdom,pretty_print=True)))
-                fileOut.close()
-            if argList['createType']=='email' :
-                fileOut=tempfile.NamedTemporaryFile(suffix=".html",delete=True)
-                msgOut=tempfile.NamedTemporaryFile(suffix=".txt",delete=True)
-                msgOut.write(emailMsgOut)
-                transform=XSLT_ET.XSLT(xslt)
-                newdom=transform(xml1,contactEmail="'"+contactEmail+"'")
-                try:
-                    fileOut.write(XSLT_ET.tostring(newdom,pretty_print=True))
-                    #print(fileOut.name)
-                    fileOut.seek(0)
-                    msgOut.seek(0)
-                    os.system(emailCmd+" -a "+fileOut.name+" "+contactEmail+" <"+msgOut.name)
-                    fileOut.close()
-                except:
-                    # if there is no output for file, do nothing and close it
-                    fileOut.close()
-                msgOut.close()
-
-
-
-    
-
-
+                print(htmlString)
+            # contacts without downloads get no report, so no email
+            if argList['createType']=='email' and htmlString is not None:
+                attachmentName=contactEmail.strip().replace("@","_at_")+".html"
+                message=pastaMail.buildMessage(argList['emailFrom'],contactEmail.strip(),emailSubject,emailMsgOut,attachmentName,htmlString)
+                mailSender.send(argList['emailFrom'],contactEmail.strip(),message)
+        if renderPool is not None:
+            renderPool.close()
+            renderPool.join()
+        renderTimer.stop()
+        if argList['createType']=='email' :
+            with pastaStats.phase('deliver'):
+                mailFailures=mailSender.close()
+            if args.quiet:
+                sys.stderr.write(str(mailSender.sentCount)+" reports sent, "+str(len(mailFailures))+" failed\n")
+summaryDocument.close()
+if argList['statsFile'] != '':
+    pastaStats.writeSummary(argList['statsFile'])
@@ -8,7 +8,7 @@
 <xsl:template name="root" match="/">
     <xsl:for-each select="/pastaSummaries/pastaSummary/contacts/contact/electronicMailAddress">
         <xsl:if test="contains(.,$contactEmail)='true'">
-        <xsl:if test="../../../dataDownloadTotalCount > 0">
+        <xsl:if test="../../../dataDownloadTotalCount > 0 or ../../../dataDownloadTotalCount = 'unknown'">
        <html>
        <center>
         <h1>PASTA Download Summary for <xsl:value-of select="$contactEmail"/></h1>
@@ -27,7 +27,7 @@
     <xsl:template name="pastaSummary">
         <xsl:for-each select="./contacts/contact/electronicMailAddress">
         <xsl:if test="contains(.,$contactEmail)='true'">
-        <xsl:if test="../../../dataDownloadTotalCount > 0">
+        <xsl:if test="../../../dataDownloadTotalCount > 0 or ../../../dataDownloadTotalCount = 'unknown'">
             <hr>
                 <p><b> <xsl:value-of select="../../../packageId"/> - <xsl:value-of select="../../../title"/></b><br></br>
                 Metadata Views: <xsl:value-of select="../../../metadataDownloadCount"/>,     Data Downloads: <xsl:value-of select="../../../dataDownloadTotalCount"/> 
@@ -5,11 +5,19 @@
 
 import urllib2
 #import urllib  # for python3
-import sys,argparse,os,tempfile
+import sys,argparse,os,tempfile,socket
+from collections import deque
+from multiprocessing.pool import ThreadPool
 from datetime import datetime,timedelta,time
 import xml.etree.ElementTree as ET
 import lxml.etree as XSLT_ET
 from getpass import getpass
+import pastaClient
+import pastaAudit
+import pastaCache
+import pastaStats
+import pastaJournal
+import pastaPlan
 
 DEBUG=0
 
@@ -31,8 +39,22 @@ parser.add_argument('--revision','-r',type=int,default=-999,required=False,dest=
 parser.add_argument('--fromdate','-f',type=str,dest='pastaFromTime',default=pastaFromTime,help='e.g., 2013-12-30, or 2013-11-18T13:05:00')
 parser.add_argument('--todate','-t',type=str,dest='pastaToTime',default=pastaToTime,help='e.g., 2013-11-18T13:05:00')
 parser.add_argument('--quiet','-q',action="store_false",default='store_true',help="suppress messages during processing")
+parser.add_argument('--cache','-k',type=str,default='',dest='cacheFile',help='name of a file in which to keep package metadata between runs, e.g. pastaCache.sqlite')
+parser.add_argument('--cachesize',type=int,default=pastaCache.defaultCacheSize,dest='cacheSize',help='largest size of the package metadata cache in megabytes. Default is '+str(pastaCache.defaultCacheSize))
+parser.add_argument('--auditstore','-s',type=str,default='',dest='auditStore',help="name of a file in which to keep the audit records of the scope between runs, e.g. pastaAudit.sqlite. Only records newer than those already in the file are requested")
+parser.add_argument('--bulkaudit','-b',action="store_true",default=False,dest='bulkAudit',help="harvest the audit records for the whole scope in a few large requests instead of one request per package and entity")
+parser.add_argument('--workers','-w',type=int,default=1,dest='workers',help='number of audit reports to fetch at the same time. Default is 1 (one at a time)')
+parser.add_argument('--stats',type=str,default='',dest='statsFile',help="name of a file in which to write the number, times and sizes of the requests to each kind of PASTA endpoint and the time of each step of the run as JSON, or - for stderr")
+parser.add_argument('--journal','-j',type=str,default='',dest='journalFile',help="name of a file in which to record the rows of each package revision as it is finished, e.g. pastaJournal.sqlite, so that a run that stops can be continued with --resume")
+parser.add_argument('--resume',action="store_true",default=False,dest='resume',help="continue the run recorded in the --journal file. Revisions already in it are not requested again")
+parser.add_argument('--histogram',choices=pastaAudit.histogramIntervals,default='',dest='histogram',help="instead of one total for the period, list the downloads of each entity, package and the whole scope in each day, week or month of the period, all from one harvest of the audit records of the scope (as with --bulkaudit, or from the --auditstore file)")
+parser.add_argument('--skipinactive',action="store_true",default=False,dest='skipInactive',help="look up only the package revisions with audit records in the period, found from one harvest of the audit records of the scope (as with --bulkaudit, or from the --auditstore file). The others had no downloads and are skipped without any request")
 
 args=parser.parse_args()
+if args.resume and args.journalFile == '':
+    parser.error("--resume needs the --journal file of the run to continue")
+if args.histogram != '' and args.journalFile != '':
+    parser.error("--journal can't be used with --histogram")
 argList=vars(args)
 pastaScope=argList['PASTAscope']
 # set or get username and password or authorization file
@@ -77,116 +99,73 @@ else:
     pastaRev=''
 pastaFromTime=argList['pastaFromTime']
 pastaToTime=argList['pastaToTime']
-
-## Define functions for later
-def openUrl(req,timeOut):
+# a resumed run covers the period of the run it continues unless dates are given
+if argList['resume']:
+    journalParameters=pastaJournal.savedParameters(argList['journalFile'])
+    if journalParameters is not None:
+        if pastaFromTime == parser.get_default('pastaFromTime'):
+            pastaFromTime=journalParameters['pastaFromTime']
+        if pastaToTime == parser.get_default('pastaToTime'):
+            pastaToTime=journalParameters['pastaToTime']
+if argList['cacheFile'] != '':
+    packageCache=pastaCache.PackageCache(argList['cacheFile'],argList['cacheSize'])
+else:
+    packageCache=None
+workers=argList['workers']
+histogramInterval=argList['histogram']
+runJournal=None
+if argList['journalFile'] != '':
+    runParameters={'script':'PastaUseCountBasic.py','pastaScope':pastaScope,'pastaFromTime':pastaFromTime,'pastaToTime':pastaToTime,
+                   'identifier':pastaId,'revision':pastaRev}
     try:
-       usock=urllib2.urlopen(req,timeout=timeOut)
-    except urllib2.URLError:
-       sys.stderr.write("Retrying url request \n")
-       try:
-           usock=urllib2.urlopen(req,timeout=timeOut)
-       except urllib2.URLError:
-           sys.stderr.write("Retrying url request again \n")
-           try:
-               usock=urllib2.urlopen(req,timeout=timeOut)
-           except urllib2.URLError:
-               sys.stderr.write("Retrying url request last time \n")
-               usock=urllib2.urlopen(req,timeout=timeOut)
-    return(usock)
+        runJournal=pastaJournal.RunJournal(argList['journalFile'],runParameters,argList['resume'])
+    except ValueError,e:
+        sys.stderr.write(str(e)+"\n")
+        sys.exit(1)
+    if args.quiet and argList['resume']:
+        sys.stderr.write("resuming with "+str(runJournal.resumedCount)+" package revisions from "+argList['journalFile']+"\n")
 
+## Define functions for later
 def metadataUseCount(pastaScope,pastaId,pastaVersion):
     pastaUrl="http://pasta.lternet.edu/audit/report"
     pastaResource="https://pasta.lternet.edu/package/metadata/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)
- 
-    if pastaToTime == '':
-    #    pastaToTime=datetime.today().strftime("%Y-%m-%dT%H:%M:%S")
-    #    print pastaToTime
-        pastaQueryString=pastaUrl+'/?resourceId='+pastaResource+'&fromTime='+pastaFromTime
-    else:
-            pastaQueryString=pastaUrl+'/?resourceId='+pastaResource+'&fromTime='+pastaFromTime+'&toTime='+pastaToTime
+    # fromTime and toTime are added for each shard of the period
+    pastaQueryString=pastaUrl+'/?resourceId='+pastaResource
     if DEBUG:
         sys.stderr.write(pastaQueryString)
-    req=urllib2.Request(pastaQueryString)
     #req=urllib2.Request('https://pasta.lternet.edu/audit/report/?resourceId=https://pasta.lternet.edu/package/data/eml/knb-lter-vcr/26/15/VCR97019&fromTime=2012-09-01T00:00:00')
-
-    req.add_header('Authorization', userData)
-#    usock=urllib2.urlopen(req,timeout=160)
-    usock=openUrl(req,160)
-    if(DEBUG==1):
-        sys.stderr.write("\nMETADATA ------------")
-        sys.stderr.write("url: "+str(usock.geturl()))
-        sys.stderr.write("HTML return code: "+str(usock.getcode()))
-        sys.stderr.write(str(usock.info()))
-        sys.stderr.write(str(usock.readlines()))
-        usock.close()
-#       usock=urllib2.urlopen(req,timeout=timeOut)
-        usock=openUrl(req,160)
-        
-    xmlTree = ET.parse(usock)
-    xmlRoot=xmlTree.getroot()
-    auditRecords=xmlRoot.findall('.//auditRecord')
-    return(len(auditRecords))
-## uncomment this to print out list of metadata downloads
+    return(pastaAudit.shardedAuditCounts(pastaQueryString,pastaFromTime,pastaToTime,userData,pastaAudit.countRecords,pastaAudit.addCounts))
+## to print out list of metadata downloads use this as the tally
+##    def printRecords(auditRecords):
 ##        for nodeA in auditRecords:
 ##            print("Metadata Download: "+nodeA.find('./entryTime').text+" user "+nodeA.find('./user').text)
 ##        
 
-def entityReport(pastaScope,pastaId,pastaVersion,pastaEntity):
+def entityAuditCounts(pastaScope,pastaId,pastaVersion,pastaEntity):
     pastaUrl="http://pasta.lternet.edu/audit/report"
     pastaResource="https://pasta.lternet.edu/package/data/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)+"/"+pastaEntity
     #print pastaResource
-
-    if pastaToTime == '':
-    #    pastaToTime=datetime.today().strftime("%Y-%m-%dT%H:%M:%S")
-    #    print pastaToTime
-        pastaQueryString=pastaUrl+'/?serviceMethod=readDataEntity&resourceId='+pastaResource+'&fromTime='+pastaFromTime
-    else:
-            pastaQueryString=pastaUrl+'/?serviceMethod=readDataEntity&resourceId='+pastaResource+'&fromTime='+pastaFromTime+'&toTime='+pastaToTime
+    # fromTime and toTime are added for each shard of the period
+    pastaQueryString=pastaUrl+'/?serviceMethod=readDataEntity&resourceId='+pastaResource
     if DEBUG:
         sys.stderr.write(pastaQueryString)
 
-    req=urllib2.Request(pastaQueryString)
-        
-    req.add_header('Authorization', userData)
-
     try:
-        usock=urllib2.urlopen(req)
-        if(DEBUG==1):
-            sys.stderr.write("\nDATA ------------")
-            sys.stderr.write("url: "+str(usock.geturl()))
-            sys.stderr.write("HTML return code: "+str(usock.getcode()))
-            sys.stderr.write(str(usock.info()))
-            sys.stderr.write(str(usock.readlines()))
-            usock.close()
-#            usock=urllib2.urlopen(req,timeout=160)
-            usock=openUrl(req,160)
-    except:
-        entityDownloadCountX=ET.SubElement(entitiesX,"entityDownloadCount")
-        entityDownloadCountX.text="0"
-        return(0)
-    #print raw XML output for debug
-    #print(usock.read())
-    xmlTree = ET.parse(usock)
-    xmlRoot=xmlTree.getroot()
-    blist=xmlRoot.findall('.//auditRecord')
-    #print(blist)
+        return(pastaAudit.shardedAuditCounts(pastaQueryString,pastaFromTime,pastaToTime,userData,pastaAudit.tallyEntityRecords,pastaAudit.mergeEntityCounts))
+    except (socket.error,urllib2.URLError),e:
+        sys.stderr.write("audit report failed for "+pastaResource+" ("+str(e)+") - download count unknown\n")
+        return(None)
+
+# add the counts from entityAuditCounts to the entity XML and return the
+# number of successful downloads, or None if the audit report failed
+def addEntityCounts(entityX,entityCounts):
+    if entityCounts is None:
+        entityDownloadCountX=ET.SubElement(entityX,"entityDownloadCount")
+        entityDownloadCountX.text="unknown"
+        return(None)
+    (recordCount,myCount,userArray)=entityCounts
     entityDownloadCountX=ET.SubElement(entityX,"entityDownloadCount")
-    entityDownloadCountX.text=str(len(blist))
-    #print("Number of Downloads: "+str(len(blist)))
-    myCount=0
-    userArray={'public':0}
-    for b in blist:
-        responseStatus=b.find('./responseStatus').text
-        user=b.find('./user').text
-# only count if download didn't fail with 401 code
-        if responseStatus != '401':
-            myCount=myCount+1
-            if user in userArray:
-                userArray[user]=userArray[user]+1
-            else:
-                userArray[user]=1
-    #print("myCount= "+str(myCount)+"\n")
+    entityDownloadCountX.text=str(recordCount)
     sortedUsers= sorted(userArray.keys(),key=lambda i: userArray[i])
     sortedUsers.reverse()
     entityUserCountX=ET.SubElement(entityX,"entityUserCount")
@@ -201,11 +180,130 @@ def entityReport(pastaScope,pastaId,pastaVersion,pastaEntity):
 
             #print("user= "+myKey+ "   downloads="+str(userArray[myKey])
     return(myCount)        
+
+## Audit reports can be fetched by a pool of worker threads (--workers).
+## Each request is queued with a function to be run on its result. The
+## results are always handled in the order the requests were queued, so
+## the CSV rows come out in the same order as when run one at a time.
+auditPool=None
+pendingAudits=deque()
+
+def queueAudit(auditFunction,auditArgs,handleResult):
+    if auditPool is None:
+        handleResult(auditFunction(*auditArgs))
+        return
+    pendingAudits.append((auditPool.apply_async(auditFunction,auditArgs),handleResult))
+    # keep a limited number of requests waiting so memory use stays small
+    while len(pendingAudits) > workers*4:
+        finishAudit()
+
+def finishAudit():
+    (auditResult,handleResult)=pendingAudits.popleft()
+    if auditResult is None:
+        handleResult(None)
+    else:
+        handleResult(auditResult.get())
+
+# run handleResult(None) once everything queued before it has been handled
+def queueStep(handleResult):
+    if auditPool is None:
+        handleResult(None)
+        return
+    pendingAudits.append((None,handleResult))
+
+def finishAllAudits():
+    while len(pendingAudits) > 0:
+        finishAudit()
+
+def setMetadataCount(metadataDownloadCountX):
+    def handleResult(metadataCount):
+        metadataDownloadCountX.text=str(metadataCount)
+    return(handleResult)
+
+# the rows printed are also added to revisionRows, for the journal, and
+# entities whose audit report failed to failedEntities
+def printEntityRow(pastaId,pastaVersion,title,entityName,entityX,revisionRows,failedEntities):
+    def handleResult(entityCounts):
+        dataDownloadCount=addEntityCounts(entityX,entityCounts)
+#        print("dataDownloadCount=",str(dataDownloadCount))
+        # an entity whose audit report failed is listed with an unknown count
+        if dataDownloadCount is None:
+            dataDownloadCount="unknown"
+            failedEntities.append(entityName)
+        if dataDownloadCount == "unknown" or dataDownloadCount > 0:
+            csvRow=pastaScope+","+str(pastaId)+","+str(pastaVersion)+',"'+title+'",'+entityName+","+str(dataDownloadCount)+","+str(pastaFromTime)+","+str(pastaToTime)
+            print(csvRow)
+            revisionRows.append(csvRow)
+    return(handleResult)
+
+# record the rows of a revision once all its entities have been printed.
+# A revision with a failed audit report is not recorded, so that a resumed
+# run asks for it again
+def journalRows(pastaId,pastaVersion,revisionRows,failedEntities):
+    def handleResult(noResult):
+        if len(failedEntities) > 0:
+            return
+        runJournal.put(pastaId,pastaVersion,revisionRows)
+    return(handleResult)
+
+# print the rows of a revision finished by an earlier run
+def printJournalRows(revisionRows):
+    def handleResult(noResult):
+        for csvRow in revisionRows:
+            print(csvRow)
+    return(handleResult)
        
 
+## With --histogram the downloads of each entity are listed for each day,
+## week or month of the period, followed by the totals of the package.
+## The totals of the whole scope are listed at the end
+scopeHistogram={}
+
+def printHistogram(rowStart,histogram):
+    for period in periods:
+        print(rowStart+","+period+","+str(histogram.get(period,0)))
+
+def printHistogramRows(pastaId,pastaVersion,title,entities):
+    packageHistogram={}
+    for (entityName,pastaEntity) in entities:
+        entityHistogram=scopeAudit.entityHistogram(pastaScope,pastaId,pastaVersion,pastaEntity,histogramInterval)
+        # like the totals, only entities with downloads are listed
+        if entityHistogram:
+            printHistogram("entity,"+pastaScope+","+str(pastaId)+","+str(pastaVersion)+',"'+title+'",'+entityName,entityHistogram)
+            pastaAudit.addHistogram(packageHistogram,entityHistogram)
+    if packageHistogram:
+        printHistogram("package,"+pastaScope+","+str(pastaId)+","+str(pastaVersion)+',"'+title+'",',packageHistogram)
+        pastaAudit.addHistogram(scopeHistogram,packageHistogram)
+
 # START MAIN PROGRAM
 # Read input email address file
 # create output ElementTree XML structure
+if workers > 1:
+    auditPool=ThreadPool(workers)
+scopeAudit=None
+# answer all the audit questions from one harvest of the whole scope
+if argList['auditStore'] != '':
+    if args.quiet:
+        sys.stderr.write("updating audit records for scope: "+pastaScope+" in "+argList['auditStore']+"\n")
+    with pastaStats.phase('audit'):
+        scopeAudit=pastaAudit.AuditStore(argList['auditStore'],pastaScope,pastaFromTime,pastaToTime,userData).harvest()
+elif argList['bulkAudit'] or histogramInterval != '' or argList['skipInactive']:
+    if args.quiet:
+        sys.stderr.write("harvesting audit records for scope: "+pastaScope+"\n")
+    with pastaStats.phase('audit'):
+        scopeAudit=pastaAudit.ScopeAudit(pastaScope,pastaFromTime,pastaToTime,userData).harvest()
+if scopeAudit is not None:
+    metadataUseCount=scopeAudit.metadataUseCount
+    entityAuditCounts=scopeAudit.entityAuditCounts
+# revisions without audit records in the period have no rows, so they are skipped
+revisionPlan=None
+if argList['skipInactive']:
+    revisionPlan=pastaPlan.RevisionPlan(pastaScope,scopeAudit.activeRevisions())
+# time each step. With --workers the audit reports of many entities are
+# fetched at once, so their seconds are summed over the threads
+metadataUseCount=pastaStats.timed('audit',metadataUseCount)
+entityAuditCounts=pastaStats.timed('audit',entityAuditCounts)
+packageInfo=pastaStats.timed('metadata',pastaCache.packageInfo)
 xRoot=ET.Element('pastaSummaries')
 fromTimeX=ET.SubElement(xRoot,"fromTime")
 fromTimeX.text=pastaFromTime
@@ -217,90 +315,95 @@ if pastaId == '':
     pastaReq=urllib2.Request(pastaUrl)    
     pastaReq.add_header('Authorization', userData)
 #    pastaSock=urllib2.urlopen(pastaReq,timeout=160)
-    pastaSock=openUrl(pastaReq,160)
-    pastaIds=pastaSock.read()
+    with pastaStats.phase('listing'):
+        pastaSock=pastaClient.urlopen(pastaReq,timeout=160)
+        pastaIds=pastaSock.read()
 else:
     pastaIds=pastaId
     #print pastaString
 
-print("Scope,Identifier,Revision,Title,Entity,DownloadCount,StartDate,EndDate")
+if histogramInterval != '':
+    periods=pastaAudit.histogramPeriods(pastaFromTime,pastaToTime,histogramInterval)
+    print("Level,Scope,Identifier,Revision,Title,Entity,PeriodStart,DownloadCount")
+else:
+    print("Scope,Identifier,Revision,Title,Entity,DownloadCount,StartDate,EndDate")
 for pastaId in pastaIds.split():
-    if pastaRev == '':
+    if revisionPlan is not None and not revisionPlan.queryIdentifier(pastaId):
+        if args.quiet:
+            sys.stderr.write("skipping identifier: "+pastaScope+"/"+str(pastaId)+" - no audit records in the period\n")
+        continue
+    if pastaRev == '' and runJournal is not None and runJournal.getVersions(pastaId) is not None:
+        pastaVersions=runJournal.getVersions(pastaId)
+    elif pastaRev == '':
         pastaUrl="http://pasta.lternet.edu/package/eml/"+pastaScope+"/"+pastaId                      
         pastaReq=urllib2.Request(pastaUrl)    
         pastaReq.add_header('Authorization', userData)
 #        pastaSock=urllib2.urlopen(pastaReq,timeout=60)
-        pastaSock=openUrl(pastaReq,60)
-        #produce a list of versions
-        pastaVersions=pastaSock.read().split()
+        with pastaStats.phase('listing'):
+            pastaSock=pastaClient.urlopen(pastaReq,timeout=60)
+            #produce a list of versions
+            pastaVersions=pastaSock.read().split()
         # most recent version first so reverse order of versions
         pastaVersions.reverse()
+        if runJournal is not None:
+            runJournal.putVersions(pastaId,pastaVersions)
     else:
         pastaVersions=[pastaRev]
     for pastaVersion in pastaVersions:
+        if revisionPlan is not None and not revisionPlan.queryRevision(pastaId,pastaVersion):
+            if args.quiet:
+                sys.stderr.write("skipping package: "+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)+" - no audit records in the period\n")
+            continue
+        if runJournal is not None and runJournal.isFinished(pastaId,pastaVersion):
+            queueStep(printJournalRows(runJournal.get(pastaId,pastaVersion)))
+            continue
+        revisionRows=[]
+        failedEntities=[]
         pastaSummaryX=ET.SubElement(xRoot,"pastaSummary")    
         if args.quiet:
              sys.stderr.write("processing package: "+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)+"\n")
         # Get the data package metadata to extract dataset title and entities
-        # liburl2 truncates downloaded data at 32768 bytes if HTTPS used
-        emlUrl="http://pasta.lternet.edu/package/metadata/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)
-        emlReq=urllib2.Request(emlUrl)
-        emlReq.add_header('Authorization', userData)
-#        emlSock=urllib2.urlopen(emlReq,timeout=60)
-        emlSock=openUrl(emlReq,60)
-        emlString=emlSock.read()
-        if(DEBUG==1):
-            sys.stderr.write("url: "+str(emlSock.geturl()))
-            sys.stderr.write("HTML return code: "+str(emlSock.getcode()))
-            sys.stderr.write(str(emlSock.info()))
-            sys.stderr.write(emlString)
-        emlRoot=ET.fromstring(emlString)
+        packageData=packageInfo(pastaScope,pastaId,pastaVersion,userData,packageCache)
+        # an audit store keeps the title and entities too, for PastaUseCountQuery.py
+        if scopeAudit is not None:
+            scopeAudit.addPackage(pastaId,pastaVersion,packageData)
         packageIdX=ET.SubElement(pastaSummaryX,"packageId")
         packageIdX.text=pastaScope+"."+str(pastaId)+"."+str(pastaVersion)
         titleX=ET.SubElement(pastaSummaryX,"title")
-        titleX.text=emlRoot.find('./dataset/title').text
+        titleX.text=packageData['title']
         contactsX=ET.SubElement(pastaSummaryX,"contacts")
  
-        contactEmails=emlRoot.findall('./dataset/contact/electronicMailAddress')
+        contactEmails=packageData['contacts']
         contactNumber=0
-        #print(emlString)
-    # Set up a list of entity names for use later
-        entityRecords=emlRoot.findall('.//entityName')
-        ##print("contains "+str(len(entityRecords))+" data entities");
-        ##for entityRecord in entityRecords:
-        ##    print(entityRecord.text)
+        if histogramInterval != '':
+            printHistogramRows(pastaId,pastaVersion,titleX.text,packageData['entities'])
+            continue
         metadataDownloadCountX=ET.SubElement(pastaSummaryX,"metadataDownloadCount")
-        metadataDownloadCountX.text=str(metadataUseCount(pastaScope,pastaId,pastaVersion))
-        entityCounter=0
-        pastaUrl="http://pasta.lternet.edu/package/data/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)
-        #print(pastaUrl)
-        req1=urllib2.Request(pastaUrl)
-        req1.add_header('Authorization', userData)
-#        usock=urllib2.urlopen(req1)
-        usock=openUrl(req1,60)
-        pastaEntitiesId=usock.read()
+        queueAudit(metadataUseCount,(pastaScope,pastaId,pastaVersion),setMetadataCount(metadataDownloadCountX))
         entitiesX=ET.SubElement(pastaSummaryX,"entities")
         dataDownloadTotalCount=0
-        for pastaEntity in pastaEntitiesId.split():
+        for (entityName,pastaEntity) in packageData['entities']:
             entityX=ET.SubElement(entitiesX,"entity")
-            entityName=entityRecords[entityCounter].text
             entityNameX=ET.SubElement(entityX,"entityName")
             entityNameX.text=entityName
             entityIdX=ET.SubElement(entityX,"entityId")
             entityIdX.text=pastaEntity
-            entityCounter=entityCounter+1
-#            print("\nEntity",entityCounter,entityName)
-            dataDownloadCount=entityReport(pastaScope,pastaId,pastaVersion,pastaEntity)
-#            print("dataDownloadCount=",str(dataDownloadCount))
-            if (dataDownloadCount > 0):
-                print(pastaScope+","+str(pastaId)+","+str(pastaVersion)+',"'+titleX.text+'",'+entityName+","+str(dataDownloadCount)+","+str(pastaFromTime)+","+str(pastaToTime))
+#            print("\nEntity",entityName)
+            queueAudit(entityAuditCounts,(pastaScope,pastaId,pastaVersion,pastaEntity),printEntityRow(pastaId,pastaVersion,titleX.text,entityName,entityX,revisionRows,failedEntities))
+        if runJournal is not None:
+            queueStep(journalRows(pastaId,pastaVersion,revisionRows,failedEntities))
 #        dataDownloadTotalCountX=ET.SubElement(pastaSummaryX,"dataDownloadTotalCount")
 #        dataDownloadTotalCountX.text=str(dataDownloadTotalCount)        
 #        print "download count is: "+dataDownloadTotalCountX.text
-
-
-
-
-    
-
-
+finishAllAudits()
+if histogramInterval != '':
+    printHistogram("scope,"+pastaScope+",,,,",scopeHistogram)
+if auditPool is not None:
+    auditPool.close()
+    auditPool.join()
+if revisionPlan is not None:
+    pastaStats.addSection('plan',revisionPlan.summary())
+    if args.quiet:
+        sys.stderr.write(revisionPlan.summaryMessage())
+if argList['statsFile'] != '':
+    pastaStats.writeSummary(argList['statsFile'])
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# This answers PASTA download questions from an audit store file (made by
+# PastaUseCountBasic.py, PASTAsummary.py or PastaUseCountwUsers.py with
+# --auditstore) without using the network. By default it writes the same
+# comma-separated-value list as PastaUseCountBasic.py
+
+import sys,argparse,os
+from datetime import datetime,timedelta
+import pastaAudit
+
+# set default values in case no command line values are given
+pastaToTime=datetime.today()
+pastaFromTime=(pastaToTime-timedelta(days=31)).strftime("%Y-%m-%dT%H:%M:%S")
+pastaToTime=pastaToTime.strftime("%Y-%m-%dT%H:%M:%S")
+
+parser=argparse.ArgumentParser(prog=sys.argv[0],description='Produce comma-separated-value files for data entity downloads to standard output from an audit store file, without using the network',usage='%(prog)s [options --help]  PASTAscope')
+parser.add_argument('PASTAscope', type=str,help='PASTA scope for report e.g. knb-lter-vcr')
+parser.add_argument('--auditstore','-s',type=str,default='pastaAudit.sqlite',dest='auditStore',help="audit store file made with --auditstore by the other scripts. Default is pastaAudit.sqlite")
+parser.add_argument('--identifier','-i',type=int,default=-999,required=False,dest='identifier',help='PASTA identifier')
+parser.add_argument('--revision','-r',type=int,default=-999,required=False,dest='revision',help='PASTA revision')
+parser.add_argument('--fromdate','-f',type=str,dest='pastaFromTime',default=pastaFromTime,help='e.g., 2013-12-30, or 2013-11-18T13:05:00')
+parser.add_argument('--todate','-t',type=str,dest='pastaToTime',default=pastaToTime,help='e.g., 2013-11-18T13:05:00')
+parser.add_argument('--report',dest='report',choices=['entity','user','package'],default='entity',type=str,help="entity: downloads of each entity, as PastaUseCountBasic.py. user: downloads of each entity by each user. package: metadata and data downloads of each package revision. Default is entity")
+parser.add_argument('--quiet','-q',action="store_false",default='store_true',help="suppress messages during processing")
+
+args=parser.parse_args()
+argList=vars(args)
+pastaScope=argList['PASTAscope']
+if argList['identifier'] >= 0:
+    pastaId=str(argList['identifier'])
+else:
+    pastaId=''
+if argList['revision'] >= 0:
+    pastaRev=str(argList['revision'])
+else:
+    pastaRev=''
+pastaFromTime=argList['pastaFromTime']
+pastaToTime=argList['pastaToTime']
+
+if not os.path.exists(argList['auditStore']):
+    sys.stderr.write("audit store "+argList['auditStore']+" not found\n")
+    sys.exit(1)
+# the store is only read, never harvested
+auditStore=pastaAudit.AuditStore(argList['auditStore'],pastaScope,pastaFromTime,pastaToTime,'',readOnly=True)
+
+# warn when the period asked for is not all in the file
+harvestedPeriod=auditStore.harvestedPeriod()
+if harvestedPeriod is None:
+    sys.stderr.write("no audit records for scope "+pastaScope+" in "+argList['auditStore']+"\n")
+elif args.quiet:
+    if auditStore.fromTime < harvestedPeriod[0]:
+        sys.stderr.write("audit records in "+argList['auditStore']+" start at "+harvestedPeriod[0]+", so earlier downloads are missing\n")
+    # the store only knows the time of its latest record, not when it was harvested
+    if auditStore.toTime > harvestedPeriod[1]:
+        sys.stderr.write("latest audit record in "+argList['auditStore']+" is from "+harvestedPeriod[1]+"\n")
+
+# START MAIN PROGRAM
+if argList['report'] == 'entity':
+    print("Scope,Identifier,Revision,Title,Entity,DownloadCount,StartDate,EndDate")
+elif argList['report'] == 'user':
+    print("Scope,Identifier,Revision,Title,Entity,User,DownloadCount,StartDate,EndDate")
+else:
+    print("Scope,Identifier,Revision,Title,MetadataDownloadCount,DataDownloadCount,StartDate,EndDate")
+for packageData in auditStore.storedPackages(pastaId,pastaRev):
+    pastaId=packageData['pastaId']
+    pastaVersion=packageData['pastaVersion']
+    rowStart=pastaScope+","+pastaId+","+pastaVersion+',"'+(packageData['title'] or '')+'",'
+    dataDownloadTotalCount=0
+    for (entityName,pastaEntity) in packageData['entities']:
+        (recordCount,dataDownloadCount,userArray)=auditStore.entityAuditCounts(pastaScope,pastaId,pastaVersion,pastaEntity)
+        dataDownloadTotalCount=dataDownloadTotalCount+dataDownloadCount
+        # like PastaUseCountBasic.py, only entities with downloads are listed
+        if dataDownloadCount == 0:
+            continue
+        if argList['report'] == 'entity':
+            print(rowStart+entityName+","+str(dataDownloadCount)+","+str(pastaFromTime)+","+str(pastaToTime))
+        elif argList['report'] == 'user':
+            sortedUsers=sorted(userArray.keys(),key=lambda i: userArray[i])
+            sortedUsers.reverse()
+            for user in sortedUsers:
+                if userArray[user] > 0:
+                    print(rowStart+entityName+',"'+user+'",'+str(userArray[user])+","+str(pastaFromTime)+","+str(pastaToTime))
+    if argList['report'] == 'package':
+        print(rowStart+str(auditStore.metadataUseCount(pastaScope,pastaId,pastaVersion))+","+str(dataDownloadTotalCount)+","+str(pastaFromTime)+","+str(pastaToTime))
+auditStore.close()
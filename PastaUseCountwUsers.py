@@ -5,11 +5,16 @@
 
 import urllib2
 #import urllib  # for python3
-import sys,argparse,os,tempfile
+import sys,argparse,os,tempfile,socket
 from datetime import datetime,timedelta,time
 import xml.etree.ElementTree as ET
 import lxml.etree as XSLT_ET
 from getpass import getpass
+import pastaClient
+import pastaAudit
+import pastaCache
+import pastaPlan
+import pastaDocument
 
 DEBUG=0
 
@@ -32,8 +37,15 @@ parser.add_argument('--revision','-r',type=int,default=-999,required=False,dest=
 parser.add_argument('--fromdate','-f',type=str,dest='pastaFromTime',default=pastaFromTime,help='e.g., 2013-12-30, or 2013-11-18T13:05:00')
 parser.add_argument('--todate','-t',type=str,dest='pastaToTime',default=pastaToTime,help='e.g., 2013-11-18T13:05:00')
 parser.add_argument('--quiet','-q',action="store_false",default='store_true',help="suppress messages during processing")
+parser.add_argument('--cache','-k',type=str,default='',dest='cacheFile',help='name of a file in which to keep package metadata between runs, e.g. pastaCache.sqlite')
+parser.add_argument('--cachesize',type=int,default=pastaCache.defaultCacheSize,dest='cacheSize',help='largest size of the package metadata cache in megabytes. Default is '+str(pastaCache.defaultCacheSize))
+parser.add_argument('--auditstore','-s',type=str,default='',dest='auditStore',help="name of a file in which to keep the audit records of the scope between runs, e.g. pastaAudit.sqlite. Only records newer than those already in the file are requested")
+parser.add_argument('--export','-e',type=str,default='',dest='exportFile',help="name of an SQLite file in which to also write the audit records used (resourceId, user, entryTime, responseStatus, serviceMethod) and the counts for each package, entity and user, e.g. pastaExport.sqlite")
+parser.add_argument('--skipinactive',action="store_true",default=False,dest='skipInactive',help="look up only the package revisions with audit records in the period, found from one harvest of the audit records of the scope (or from the --auditstore file). The others had no downloads and are skipped without any request")
 
 args=parser.parse_args()
+if args.skipInactive and args.exportFile != '' and args.auditStore == '':
+    parser.error("--skipinactive with --export needs --auditstore, so that the records harvested can be exported")
 argList=vars(args)
 pastaScope=argList['PASTAscope']
 # set or get username and password or authorization file
@@ -77,98 +89,62 @@ else:
     pastaRev=''
 pastaFromTime=argList['pastaFromTime']
 pastaToTime=argList['pastaToTime']
+if argList['cacheFile'] != '':
+    packageCache=pastaCache.PackageCache(argList['cacheFile'],argList['cacheSize'])
+else:
+    packageCache=None
+# the tallies used on the audit records of each metadata document and entity
+metadataTally=pastaAudit.countRecords
+entityTally=pastaAudit.tallyEntityRecords
+auditExport=None
+if argList['exportFile'] != '':
+    auditExport=pastaAudit.AuditExport(argList['exportFile'],pastaScope,pastaFromTime,pastaToTime)
+    # the records are written to the export as they are counted
+    metadataTally=auditExport.exportingTally(metadataTally)
+    entityTally=auditExport.exportingTally(entityTally)
 
 ## Define functions for later
 def metadataUseCount(pastaScope,pastaId,pastaVersion):
     pastaUrl="http://pasta.lternet.edu/audit/report"
     pastaResource="https://pasta.lternet.edu/package/metadata/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)
- 
-    if pastaToTime == '':
-    #    pastaToTime=datetime.today().strftime("%Y-%m-%dT%H:%M:%S")
-    #    print pastaToTime
-        pastaQueryString=pastaUrl+'/?resourceId='+pastaResource+'&fromTime='+pastaFromTime
-    else:
-            pastaQueryString=pastaUrl+'/?resourceId='+pastaResource+'&fromTime='+pastaFromTime+'&toTime='+pastaToTime
+    # fromTime and toTime are added for each shard of the period
+    pastaQueryString=pastaUrl+'/?resourceId='+pastaResource
     if DEBUG:
         print(pastaQueryString)
-    req=urllib2.Request(pastaQueryString)
     #req=urllib2.Request('https://pasta.lternet.edu/audit/report/?resourceId=https://pasta.lternet.edu/package/data/eml/knb-lter-vcr/26/15/VCR97019&fromTime=2012-09-01T00:00:00')
-
-    req.add_header('Authorization', userData)
-
-    usock=urllib2.urlopen(req,timeout=160)
-    if(DEBUG==1):
-        print("\nMETADATA ------------")
-        print("url: "+str(usock.geturl()))
-        print("HTML return code: "+str(usock.getcode()))
-        print(usock.info())
-        print(usock.readlines())
-        usock.close()
-        usock=urllib2.urlopen(req,timeout=160)
-        
-    xmlTree = ET.parse(usock)
-    xmlRoot=xmlTree.getroot()
-    auditRecords=xmlRoot.findall('.//auditRecord')
-    return(len(auditRecords))
-## uncomment this to print out list of metadata downloads
+    return(pastaAudit.shardedAuditCounts(pastaQueryString,pastaFromTime,pastaToTime,userData,metadataTally,pastaAudit.addCounts))
+## to print out list of metadata downloads use this as the tally
+##    def printRecords(auditRecords):
 ##        for nodeA in auditRecords:
 ##            print("Metadata Download: "+nodeA.find('./entryTime').text+" user "+nodeA.find('./user').text)
 ##        
 
-def entityReport(pastaScope,pastaId,pastaVersion,pastaEntity):
+def entityAuditCounts(pastaScope,pastaId,pastaVersion,pastaEntity):
     pastaUrl="http://pasta.lternet.edu/audit/report"
     pastaResource="https://pasta.lternet.edu/package/data/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)+"/"+pastaEntity
     #print pastaResource
-
-    if pastaToTime == '':
-    #    pastaToTime=datetime.today().strftime("%Y-%m-%dT%H:%M:%S")
-    #    print pastaToTime
-        pastaQueryString=pastaUrl+'/?serviceMethod=readDataEntity&resourceId='+pastaResource+'&fromTime='+pastaFromTime
-    else:
-            pastaQueryString=pastaUrl+'/?serviceMethod=readDataEntity&resourceId='+pastaResource+'&fromTime='+pastaFromTime+'&toTime='+pastaToTime
+    # fromTime and toTime are added for each shard of the period
+    pastaQueryString=pastaUrl+'/?serviceMethod=readDataEntity&resourceId='+pastaResource
     if DEBUG:
         print(pastaQueryString)
 
-    req=urllib2.Request(pastaQueryString)
-        
-    req.add_header('Authorization', userData)
-
     try:
-        usock=urllib2.urlopen(req)
-        if(DEBUG==1):
-            print("\nDATA ------------")
-            print("url: "+str(usock.geturl()))
-            print("HTML return code: "+str(usock.getcode()))
-            print(usock.info())
-            print(usock.readlines())
-            usock.close()
-            usock=urllib2.urlopen(req,timeout=160)
-    except:
-        entityDownloadCountX=ET.SubElement(entitiesX,"entityDownloadCount")
-        entityDownloadCountX.text="0"
-        return(0)
-    #print raw XML output for debug
-    #print(usock.read())
-    xmlTree = ET.parse(usock)
-    xmlRoot=xmlTree.getroot()
-    blist=xmlRoot.findall('.//auditRecord')
-    #print(blist)
+        return(pastaAudit.shardedAuditCounts(pastaQueryString,pastaFromTime,pastaToTime,userData,entityTally,pastaAudit.mergeEntityCounts))
+    except (socket.error,urllib2.URLError),e:
+        sys.stderr.write("audit report failed for "+pastaResource+" ("+str(e)+") - download count unknown\n")
+        return(None)
+
+# add the counts from entityAuditCounts to the entity XML and return the
+# number of successful downloads, or None if the audit report failed
+def addEntityCounts(entityX,entityCounts):
+    if entityCounts is None:
+        entityDownloadCountX=ET.SubElement(entityX,"entityDownloadCount")
+        entityDownloadCountX.text="unknown"
+        return(None)
+    (recordCount,myCount,userArray)=entityCounts
     entityDownloadCountX=ET.SubElement(entityX,"entityDownloadCount")
-    entityDownloadCountX.text=str(len(blist))
-    #print("Number of Downloads: "+str(len(blist)))
-    myCount=0
-    userArray={'public':0}
-    for b in blist:
-        responseStatus=b.find('./responseStatus').text
-        user=b.find('./user').text
-# only count if download didn't fail with 401 code
-        if responseStatus != '401':
-            myCount=myCount+1
-            if user in userArray:
-                userArray[user]=userArray[user]+1
-            else:
-                userArray[user]=1
-    #print("myCount= "+str(myCount)+"\n")
+    entityDownloadCountX.text=str(recordCount)
+    #print("Number of Downloads: "+str(recordCount))
     sortedUsers= sorted(userArray.keys(),key=lambda i: userArray[i])
     sortedUsers.reverse()
     entityUserCountX=ET.SubElement(entityX,"entityUserCount")
@@ -187,18 +163,34 @@ def entityReport(pastaScope,pastaId,pastaVersion,pastaEntity):
 
 # START MAIN PROGRAM
 # Read input email address file
-# create output ElementTree XML structure
-xRoot=ET.Element('pastaSummaries')
-fromTimeX=ET.SubElement(xRoot,"fromTime")
-fromTimeX.text=pastaFromTime
-toTimeX=ET.SubElement(xRoot,"toTime")
-toTimeX.text=pastaToTime
+# answer all the audit questions from the stored audit records of the whole scope
+if argList['auditStore'] != '':
+    if args.quiet:
+        sys.stderr.write("updating audit records for scope: "+pastaScope+" in "+argList['auditStore']+"\n")
+    scopeAudit=pastaAudit.AuditStore(argList['auditStore'],pastaScope,pastaFromTime,pastaToTime,userData).harvest()
+    metadataUseCount=scopeAudit.metadataUseCount
+    entityAuditCounts=scopeAudit.entityAuditCounts
+    if auditExport is not None:
+        auditExport.copyStore(scopeAudit)
+elif argList['skipInactive']:
+    if args.quiet:
+        sys.stderr.write("harvesting audit records for scope: "+pastaScope+"\n")
+    scopeAudit=pastaAudit.ScopeAudit(pastaScope,pastaFromTime,pastaToTime,userData).harvest()
+    metadataUseCount=scopeAudit.metadataUseCount
+    entityAuditCounts=scopeAudit.entityAuditCounts
+# revisions without audit records in the period are skipped
+revisionPlan=None
+if argList['skipInactive']:
+    revisionPlan=pastaPlan.RevisionPlan(pastaScope,scopeAudit.activeRevisions())
+# create the output XML document. Each pastaSummary is written to a file
+# as soon as its package is finished, so the scope is not kept in memory
+summaryDocument=pastaDocument.SummaryDocument(pastaFromTime,pastaToTime)
 
 if pastaId == '':
     pastaUrl="http://pasta.lternet.edu/package/eml/"+pastaScope                      
     pastaReq=urllib2.Request(pastaUrl)    
     pastaReq.add_header('Authorization', userData)
-    pastaSock=urllib2.urlopen(pastaReq,timeout=60)
+    pastaSock=pastaClient.urlopen(pastaReq,timeout=60)
     pastaIds=pastaSock.read()
 else:
     pastaIds=pastaId
@@ -206,11 +198,15 @@ else:
 
 #print("Scope,Identifier,Revision,Title,Entity,DownloadCount,StartDate,EndDate")
 for pastaId in pastaIds.split():
+    if revisionPlan is not None and not revisionPlan.queryIdentifier(pastaId):
+        if args.quiet:
+            sys.stderr.write("skipping identifier: "+pastaScope+"/"+str(pastaId)+" - no audit records in the period\n")
+        continue
     if pastaRev == '':
         pastaUrl="http://pasta.lternet.edu/package/eml/"+pastaScope+"/"+pastaId                      
         pastaReq=urllib2.Request(pastaUrl)    
         pastaReq.add_header('Authorization', userData)
-        pastaSock=urllib2.urlopen(pastaReq,timeout=60)
+        pastaSock=pastaClient.urlopen(pastaReq,timeout=60)
         #produce a list of versions
         pastaVersions=pastaSock.read().split()
         # most recent version first so reverse order of versions
@@ -218,72 +214,65 @@ for pastaId in pastaIds.split():
     else:
         pastaVersions=[pastaRev]
     for pastaVersion in pastaVersions:
-        pastaSummaryX=ET.SubElement(xRoot,"pastaSummary")    
+        if revisionPlan is not None and not revisionPlan.queryRevision(pastaId,pastaVersion):
+            if args.quiet:
+                sys.stderr.write("skipping package: "+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)+" - no audit records in the period\n")
+            continue
+        pastaSummaryX=ET.Element("pastaSummary")
         if args.quiet:
              sys.stderr.write("processing package: "+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)+"\n")
         # Get the data package metadata to extract dataset title and entities
-        # liburl2 truncates downloaded data at 32768 bytes if HTTPS used
-        emlUrl="http://pasta.lternet.edu/package/metadata/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)
-        emlReq=urllib2.Request(emlUrl)
-        emlReq.add_header('Authorization', userData)
-        emlSock=urllib2.urlopen(emlReq,timeout=60)
-        emlString=emlSock.read()
-        if(DEBUG==1):
-            print("url: "+str(emlSock.geturl()))
-            print("HTML return code: "+str(emlSock.getcode()))
-            print(emlSock.info())
-            print(emlString)
-        emlRoot=ET.fromstring(emlString)
+        packageData=pastaCache.packageInfo(pastaScope,pastaId,pastaVersion,userData,packageCache)
+        # an audit store keeps the title and entities too, for PastaUseCountQuery.py
+        if argList['auditStore'] != '':
+            scopeAudit.addPackage(pastaId,pastaVersion,packageData)
         packageIdX=ET.SubElement(pastaSummaryX,"packageId")
         packageIdX.text=pastaScope+"."+str(pastaId)+"."+str(pastaVersion)
         titleX=ET.SubElement(pastaSummaryX,"title")
-        titleX.text=emlRoot.find('./dataset/title').text
+        titleX.text=packageData['title']
         contactsX=ET.SubElement(pastaSummaryX,"contacts")
  
-        contactEmails=emlRoot.findall('./dataset/contact/electronicMailAddress')
+        contactEmails=packageData['contacts']
         contactNumber=0
-        #print(emlString)
-    # Set up a list of entity names for use later
-        entityRecords=emlRoot.findall('.//entityName')
-        ##print("contains "+str(len(entityRecords))+" data entities");
-        ##for entityRecord in entityRecords:
-        ##    print(entityRecord.text)
         metadataDownloadCountX=ET.SubElement(pastaSummaryX,"metadataDownloadCount")
         metadataDownloadCountX.text=str(metadataUseCount(pastaScope,pastaId,pastaVersion))
-        entityCounter=0
-        pastaUrl="http://pasta.lternet.edu/package/data/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)
-        #print(pastaUrl)
-        req1=urllib2.Request(pastaUrl)
-        req1.add_header('Authorization', userData)
-        usock=urllib2.urlopen(req1)
-        pastaEntitiesId=usock.read()
+        if auditExport is not None:
+            auditExport.addPackage(pastaId,pastaVersion,titleX.text,int(metadataDownloadCountX.text))
         entitiesX=ET.SubElement(pastaSummaryX,"entities")
         dataDownloadTotalCount=0
-        for pastaEntity in pastaEntitiesId.split():
+        for (entityName,pastaEntity) in packageData['entities']:
             entityX=ET.SubElement(entitiesX,"entity")
-            entityName=entityRecords[entityCounter].text
             entityNameX=ET.SubElement(entityX,"entityName")
             entityNameX.text=entityName
             entityIdX=ET.SubElement(entityX,"entityId")
             entityIdX.text=pastaEntity
-            entityCounter=entityCounter+1
-#            print("\nEntity",entityCounter,entityName)
-            dataDownloadCount=entityReport(pastaScope,pastaId,pastaVersion,pastaEntity)
+#            print("\nEntity",entityName)
+            entityCounts=entityAuditCounts(pastaScope,pastaId,pastaVersion,pastaEntity)
+            if auditExport is not None:
+                auditExport.addEntity(pastaId,pastaVersion,pastaEntity,entityName,entityCounts)
+            dataDownloadCount=addEntityCounts(entityX,entityCounts)
 #            print("dataDownloadCount=",str(dataDownloadCount))
 #            if (dataDownloadCount > 0):
 #                print(pastaScope+","+str(pastaId)+","+str(pastaVersion)+',"'+titleX.text+'",'+entityName+","+str(dataDownloadCount)+","+str(pastaFromTime)+","+str(pastaToTime))
+        summaryDocument.add(pastaSummaryX)
 #        dataDownloadTotalCountX=ET.SubElement(pastaSummaryX,"dataDownloadTotalCount")
 #        dataDownloadTotalCountX.text=str(dataDownloadTotalCount)        
 #        print "download count is: "+dataDownloadTotalCountX.text
+if revisionPlan is not None and args.quiet:
+    sys.stderr.write(revisionPlan.summaryMessage())
+if auditExport is not None:
+    auditExport.close()
+    if args.quiet:
+        sys.stderr.write(str(auditExport.recordCount)+" audit records written to "+argList['exportFile']+"\n")
 
 
 xslt=XSLT_ET.parse(styleSheetNameCSV)
 transform=XSLT_ET.XSLT(xslt)
-xTree=ET.ElementTree(xRoot)
-xString=ET.tostring(xRoot)
-#print(xString)
-xml1=XSLT_ET.fromstring(xString)
+summaryDocument.finish()
+# the stylesheet reads the document straight from the file
+xml1=XSLT_ET.parse(summaryDocument.openDocument())
 newdom=transform(xml1)
+summaryDocument.close()
 print(newdom)
 #print(XSLT_ET.tostring(newdom,pretty_print=True))
 
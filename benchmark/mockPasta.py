@@ -0,0 +1,270 @@
+#!/usr/bin/python
+# A local stand-in for the PASTA web services used by the reporting
+# scripts, serving a synthetic scope. It answers the package (/package/eml,
+# /package/metadata/eml, /package/data/eml), audit (/audit/report) and
+# harvest list requests, and keeps a count of the requests and bytes sent.
+#
+# The scripts have the pasta.lternet.edu urls built in, so the server is
+# used as an HTTP proxy:
+#
+#   python mockPasta.py --port 8765 --packages 50 &
+#   http_proxy=http://localhost:8765 python ../PastaUseCountBasic.py knb-lter-bench
+
+import sys,argparse,time,random,threading,urlparse,cgi
+import BaseHTTPServer,SocketServer
+from datetime import datetime,timedelta
+
+DEBUG=0
+
+pastaResourceUrl="https://pasta.lternet.edu/package"
+
+auditUsers=['public','uid=jsmith,o=LTER,dc=ecoinformatics,dc=org','uid=mjones,o=LTER,dc=ecoinformatics,dc=org',
+            'uid=kbrown,o=LTER,dc=ecoinformatics,dc=org','uid=VCR,o=LTER,dc=ecoinformatics,dc=org']
+
+def parseTime(pastaTime):
+    if 'T' not in pastaTime:
+        pastaTime=pastaTime+'T00:00:00'
+    return(datetime.strptime(pastaTime[:19],"%Y-%m-%dT%H:%M:%S"))
+
+class SyntheticScope:
+
+    # packages identifiers with revisions revisions each, entities data
+    # entities in each revision and records audit records for each entity
+    # (and for each metadata document), spread over fromTime to toTime
+    def __init__(self,pastaScope='knb-lter-bench',packages=20,revisions=2,entities=3,records=20,contacts=5,
+                 fromTime='2020-01-01',toTime='2020-02-01',seed=1):
+        self.pastaScope=pastaScope
+        self.packages=packages
+        self.revisions=revisions
+        self.entities=entities
+        self.contacts=contacts
+        randomizer=random.Random(seed)
+        startTime=parseTime(fromTime)
+        periodSeconds=int((parseTime(toTime)-startTime).total_seconds())
+        # audit records as (entryTime,oid,serviceMethod,responseStatus,resourceId,user)
+        auditRecords=[]
+        for pastaId in range(1,packages+1):
+            for pastaVersion in range(1,revisions+1):
+                resources=[('readMetadata',self.metadataResourceId(pastaId,pastaVersion))]
+                for entityNumber in range(entities):
+                    resources.append(('readDataEntity',self.entityResourceId(pastaId,pastaVersion,entityNumber)))
+                for (serviceMethod,resourceId) in resources:
+                    for recordNumber in range(records):
+                        entryTime=startTime+timedelta(seconds=randomizer.randrange(periodSeconds))
+                        responseStatus='401' if randomizer.random() < 0.1 else '200'
+                        auditRecords.append([entryTime.strftime("%Y-%m-%dT%H:%M:%S"),0,serviceMethod,responseStatus,resourceId,randomizer.choice(auditUsers)])
+        auditRecords.sort()
+        oid=0
+        self.resourceRecords={}
+        for auditRecord in auditRecords:
+            oid=oid+1
+            auditRecord[1]=oid
+            self.resourceRecords.setdefault(auditRecord[4],[]).append(auditRecord)
+        self.auditRecords=auditRecords
+
+    def metadataResourceId(self,pastaId,pastaVersion):
+        return(pastaResourceUrl+"/metadata/eml/"+self.pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion))
+
+    def entityId(self,pastaId,pastaVersion,entityNumber):
+        return("e"+str(pastaId)+"x"+str(pastaVersion)+"x"+str(entityNumber))
+
+    def entityResourceId(self,pastaId,pastaVersion,entityNumber):
+        return(pastaResourceUrl+"/data/eml/"+self.pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)+"/"+self.entityId(pastaId,pastaVersion,entityNumber))
+
+    def hasPackage(self,pastaId,pastaVersion=1):
+        return(1 <= pastaId <= self.packages and 1 <= pastaVersion <= self.revisions)
+
+    def emlDocument(self,pastaId,pastaVersion):
+        emlParts=['<?xml version="1.0" encoding="UTF-8"?>\n',
+                  '<eml:eml xmlns:eml="eml://ecoinformatics.org/eml-2.1.1" packageId="'+self.pastaScope+'.'+str(pastaId)+'.'+str(pastaVersion)+'" system="knb">',
+                  '<dataset><title>Synthetic data package '+str(pastaId)+' revision '+str(pastaVersion)+'</title>',
+                  '<creator><individualName><surName>Porter</surName></individualName></creator>',
+                  '<abstract><para>'+('Long abstract text. '*50)+'</para></abstract>',
+                  '<contact><electronicMailAddress>contact'+str(pastaId%self.contacts)+'@example.edu</electronicMailAddress></contact>',
+                  '<contact><electronicMailAddress>tech-support@lternet.edu</electronicMailAddress></contact>',
+                  '<publisher><organizationName>Synthetic LTER</organizationName></publisher>']
+        for entityNumber in range(self.entities):
+            emlParts.append('<dataTable><entityName>Table '+str(entityNumber)+' of package '+str(pastaId)+'</entityName>'+
+                            '<attributeList>'+('<attribute><attributeName>column</attributeName></attribute>'*20)+'</attributeList></dataTable>')
+        emlParts.append('</dataset></eml:eml>')
+        return(''.join(emlParts))
+
+    # the harvest list has current, out of date and new documents
+    def harvestList(self):
+        listParts=['<?xml version="1.0" encoding="UTF-8"?>\n<hrv:harvestList xmlns:hrv="eml://ecoinformatics.org/harvestList">']
+        for pastaId in range(1,self.packages+self.packages/4+2):
+            pastaVersion=self.revisions+(pastaId%2)
+            listParts.append('<document><docid><scope>'+self.pastaScope+'</scope><identifier>'+str(pastaId)+'</identifier><revision>'+str(pastaVersion)+'</revision></docid>'+
+                             '<documentType>eml://ecoinformatics.org/eml-2.1.1</documentType><documentURL>http://metacat.example.edu/knb/metacat?action=read&amp;qformat=xml&amp;docid='+
+                             self.pastaScope+'.'+str(pastaId)+'.'+str(pastaVersion)+'</documentURL></document>')
+        listParts.append('</hrv:harvestList>')
+        return(''.join(listParts))
+
+    def auditReport(self,query):
+        if 'resourceId' in query:
+            auditRecords=self.resourceRecords.get(query['resourceId'][0],[])
+        else:
+            auditRecords=self.auditRecords
+        fromTime=query.get('fromTime',[''])[0]
+        toTime=query.get('toTime',[''])[0]
+        fromTime=parseTime(fromTime).strftime("%Y-%m-%dT%H:%M:%S") if fromTime else ''
+        toTime=parseTime(toTime).strftime("%Y-%m-%dT%H:%M:%S") if toTime else '9999'
+        serviceMethod=query.get('serviceMethod',[None])[0]
+        pastaScope=query.get('scope',[None])[0]
+        limit=int(query.get('limit',['0'])[0])
+        reportParts=['<?xml version="1.0" encoding="UTF-8"?>\n<auditReport>']
+        recordCount=0
+        for (entryTime,oid,recordMethod,responseStatus,resourceId,user) in auditRecords:
+            if entryTime < fromTime or entryTime > toTime:
+                continue
+            if serviceMethod is not None and recordMethod != serviceMethod:
+                continue
+            if pastaScope is not None and pastaScope != self.pastaScope:
+                continue
+            reportParts.append('<auditRecord><oid>'+str(oid)+'</oid><entryTime>'+entryTime+'.000</entryTime><category>info</category>'+
+                               '<service>DataPackageManager-1.0</service><serviceMethod>'+recordMethod+'</serviceMethod>'+
+                               '<responseStatus>'+responseStatus+'</responseStatus><resourceId>'+resourceId+'</resourceId>'+
+                               '<user>'+user+'</user><userAgent>Mozilla/5.0</userAgent><groups></groups><authSystem>https://pasta.edirepository.org/authentication</authSystem>'+
+                               '<entryText></entryText></auditRecord>')
+            recordCount=recordCount+1
+            if limit and recordCount >= limit:
+                break
+        reportParts.append('</auditReport>')
+        return(''.join(reportParts))
+
+    # the body for a url path, or None if there is no such resource
+    def respond(self,path,query):
+        pathParts=[pathPart for pathPart in path.split('/') if pathPart]
+        try:
+            if pathParts[:1] == ['harvestlist']:
+                return(self.harvestList())
+            if pathParts[:2] == ['audit','report']:
+                return(self.auditReport(query))
+            if pathParts[:2] == ['package','eml'] and len(pathParts) >= 3:
+                if pathParts[2] != self.pastaScope:
+                    return(None)
+                if len(pathParts) == 3:
+                    return('\n'.join([str(pastaId) for pastaId in range(1,self.packages+1)]))
+                pastaId=int(pathParts[3])
+                if not self.hasPackage(pastaId):
+                    return(None)
+                if len(pathParts) == 4:
+                    if query.get('filter') == ['newest']:
+                        return(str(self.revisions))
+                    return('\n'.join([str(pastaVersion) for pastaVersion in range(1,self.revisions+1)]))
+                if len(pathParts) == 5 and self.hasPackage(pastaId,int(pathParts[4])):
+                    return(self.metadataResourceId(pastaId,int(pathParts[4])))
+            if pathParts[:3] == ['package','metadata','eml'] and len(pathParts) == 6:
+                (pastaId,pastaVersion)=(int(pathParts[4]),int(pathParts[5]))
+                if pathParts[3] == self.pastaScope and self.hasPackage(pastaId,pastaVersion):
+                    return(self.emlDocument(pastaId,pastaVersion))
+            if pathParts[:3] == ['package','data','eml'] and len(pathParts) == 6:
+                (pastaId,pastaVersion)=(int(pathParts[4]),int(pathParts[5]))
+                if pathParts[3] == self.pastaScope and self.hasPackage(pastaId,pastaVersion):
+                    return('\n'.join([self.entityId(pastaId,pastaVersion,entityNumber) for entityNumber in range(self.entities)]))
+        except ValueError:
+            pass
+        return(None)
+
+class MockPastaHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version='HTTP/1.1'
+    # headers and body are written separately, which Nagle's algorithm would delay
+    disable_nagle_algorithm=True
+
+    def log_message(self,format,*args):
+        if DEBUG:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self,format,*args)
+
+    def do_HEAD(self):
+        self.do_GET(True)
+
+    def do_GET(self,headOnly=False):
+        server=self.server
+        # as a proxy the request has the full url, otherwise just the path
+        urlParts=urlparse.urlsplit(self.path)
+        query=cgi.parse_qs(urlParts.query)
+        if server.latency > 0:
+            time.sleep(server.latency*random.uniform(0.5,1.5))
+        if random.random() < server.errorRate:
+            (code,body)=(503,'Service temporarily unavailable')
+        else:
+            body=server.pastaScope.respond(urlParts.path,query)
+            code=200
+            if body is None:
+                (code,body)=(404,'Not found')
+        self.send_response(code)
+        self.send_header('Content-Type','text/plain' if body[:1] != '<' else 'application/xml')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        if not headOnly:
+            self.wfile.write(body)
+        server.countRequest(code,0 if headOnly else len(body))
+
+class MockPastaServer(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+
+    daemon_threads=True
+    allow_reuse_address=True
+    # many scripts open dozens of connections at once
+    request_queue_size=256
+
+    # latency is the average wait in seconds before each response and
+    # errorRate the fraction of requests answered with 503
+    def __init__(self,port,pastaScope,latency=0.0,errorRate=0.0):
+        BaseHTTPServer.HTTPServer.__init__(self,('127.0.0.1',port),MockPastaHandler)
+        self.pastaScope=pastaScope
+        self.latency=latency
+        self.errorRate=errorRate
+        self.lock=threading.Lock()
+        self.resetCounts()
+
+    def resetCounts(self):
+        with self.lock:
+            self.requestCount=0
+            self.errorCount=0
+            self.bytesSent=0
+
+    def countRequest(self,code,bodyBytes):
+        with self.lock:
+            self.requestCount=self.requestCount+1
+            if code >= 500:
+                self.errorCount=self.errorCount+1
+            self.bytesSent=self.bytesSent+bodyBytes
+
+    def proxyUrl(self):
+        return('http://127.0.0.1:'+str(self.server_address[1]))
+
+    # serve requests in a background thread
+    def start(self):
+        serverThread=threading.Thread(target=self.serve_forever)
+        serverThread.daemon=True
+        serverThread.start()
+        return(self)
+
+def addScopeArguments(parser):
+    parser.add_argument('--scope',type=str,default='knb-lter-bench',dest='pastaScope',help='name of the synthetic scope. Default is knb-lter-bench')
+    parser.add_argument('--packages',type=int,default=20,help='number of package identifiers in the scope. Default is 20')
+    parser.add_argument('--revisions',type=int,default=2,help='number of revisions of each package. Default is 2')
+    parser.add_argument('--entities',type=int,default=3,help='number of data entities in each revision. Default is 3')
+    parser.add_argument('--records',type=int,default=20,help='number of audit records for each data entity and metadata document. Default is 20')
+    parser.add_argument('--contacts',type=int,default=5,help='number of different contact emails in the scope. Default is 5')
+    parser.add_argument('--latency',type=float,default=0.0,help='average wait in milliseconds before each response. Default is 0')
+    parser.add_argument('--errorrate',type=float,default=0.0,dest='errorRate',help='fraction of requests answered with HTTP 503, e.g. 0.01. Default is 0')
+    parser.add_argument('--fromdate','-f',type=str,dest='pastaFromTime',default='2020-01-01',help='start of the period of the audit records. Default is 2020-01-01')
+    parser.add_argument('--todate','-t',type=str,dest='pastaToTime',default='2020-02-01',help='end of the period of the audit records. Default is 2020-02-01')
+
+def makeServer(port,args):
+    pastaScope=SyntheticScope(args.pastaScope,args.packages,args.revisions,args.entities,args.records,args.contacts,args.pastaFromTime,args.pastaToTime)
+    return(MockPastaServer(port,pastaScope,args.latency/1000.0,args.errorRate))
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(prog=sys.argv[0],description='Serve a synthetic PASTA scope for testing the reporting scripts',usage='%(prog)s [options --help]')
+    parser.add_argument('--port',type=int,default=8765,help='port to listen on. Default is 8765')
+    addScopeArguments(parser)
+    args=parser.parse_args()
+    mockServer=makeServer(args.port,args)
+    sys.stderr.write("serving "+args.pastaScope+" on "+mockServer.proxyUrl()+" - use it with http_proxy="+mockServer.proxyUrl()+"\n")
+    try:
+        mockServer.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# Runs the reporting scripts against a local mock PASTA server (see
+# mockPasta.py) holding a synthetic scope, and reports for each run the
+# wall time, the number of requests and errors seen by the server, the
+# bytes it sent and the peak memory of the script.
+#
+#   python runBenchmark.py --packages 100 --latency 50
+#   python runBenchmark.py --scripts basic --basicargs="--workers 8" --runs 3
+
+import sys,argparse,os,time,shlex,tempfile,subprocess,json
+import mockPasta
+
+benchmarkDir=os.path.dirname(os.path.abspath(__file__))
+repoDir=os.path.join(benchmarkDir,'..')
+
+# the scripts that can be run, and how they are called
+scriptNames=['basic','summary','sync']
+
+def scriptCommand(scriptName,args,authFile):
+    if scriptName == 'basic':
+        command=[os.path.join(repoDir,'PastaUseCountBasic.py'),'-q','-a',authFile,'-f',args.pastaFromTime,'-t',args.pastaToTime,args.pastaScope]
+        extraArgs=args.basicArgs
+    elif scriptName == 'summary':
+        command=[os.path.join(repoDir,'PASTAsummary','PASTAsummary.py'),'-q','-o','xml','-a',authFile,'-f',args.pastaFromTime,'-t',args.pastaToTime,args.pastaScope]
+        extraArgs=args.summaryArgs
+    else:
+        command=[os.path.join(repoDir,'PASTAstatus','PASTA_metacat_sync_report.py'),'-l','http://metacat.example.edu/harvestlist']
+        extraArgs=args.syncArgs
+    return([sys.executable]+command+shlex.split(extraArgs))
+
+# run one script and return its results
+def runScript(scriptName,command,mockServer,outputFile):
+    environment=dict(os.environ)
+    environment['http_proxy']=mockServer.proxyUrl()
+    environment.pop('no_proxy',None)
+    environment.pop('NO_PROXY',None)
+    mockServer.resetCounts()
+    startTime=time.time()
+    scriptProcess=subprocess.Popen(command,stdout=outputFile,stderr=subprocess.PIPE,env=environment)
+    errorOutput=scriptProcess.stderr.read()
+    (pid,waitStatus,resourceUsage)=os.wait4(scriptProcess.pid,0)
+    wallTime=time.time()-startTime
+    # as subprocess gives it: the exit code, or minus the signal that killed the script
+    if os.WIFSIGNALED(waitStatus):
+        exitStatus=-os.WTERMSIG(waitStatus)
+    else:
+        exitStatus=os.WEXITSTATUS(waitStatus)
+    if exitStatus != 0:
+        sys.stderr.write(scriptName+" failed:\n"+errorOutput+"\n")
+    return({'script':scriptName,
+            'command':' '.join(command),
+            'exitStatus':exitStatus,
+            'wallTime':wallTime,
+            'requests':mockServer.requestCount,
+            'errors':mockServer.errorCount,
+            'bytes':mockServer.bytesSent,
+            # ru_maxrss is in kilobytes on Linux
+            'peakMemory':resourceUsage.ru_maxrss*1024,
+            'outputBytes':outputFile.tell()})
+
+parser=argparse.ArgumentParser(prog=sys.argv[0],description='Time the PASTA reporting scripts against a local mock PASTA server',usage='%(prog)s [options --help]')
+mockPasta.addScopeArguments(parser)
+parser.add_argument('--scripts',type=str,default=','.join(scriptNames),help='comma separated list of the scripts to run: basic, summary and sync. Default is all of them')
+parser.add_argument('--runs',type=int,default=1,help='number of times to run each script. Default is 1')
+parser.add_argument('--basicargs',type=str,default='',dest='basicArgs',help='more options for PastaUseCountBasic.py, e.g. "--workers 8"')
+parser.add_argument('--summaryargs',type=str,default='',dest='summaryArgs',help='more options for PASTAsummary.py, e.g. "--async"')
+parser.add_argument('--syncargs',type=str,default='',dest='syncArgs',help='more options for PASTA_metacat_sync_report.py, e.g. "--bulk"')
+parser.add_argument('--port',type=int,default=0,help='port for the mock server. Default is any free port')
+parser.add_argument('--json',type=str,default='',dest='jsonFile',help='name of a file in which to also write the results as JSON')
+parser.add_argument('--keepoutput',action="store_true",default=False,dest='keepOutput',help="keep the output of each run in the working directory as <script>_<run>.out")
+
+args=parser.parse_args()
+
+sys.stderr.write("building synthetic scope "+args.pastaScope+"\n")
+mockServer=mockPasta.makeServer(args.port,args).start()
+authFile=tempfile.NamedTemporaryFile(suffix=".txt")
+authFile.write("Basic YmVuY2htYXJrOmJlbmNobWFyaw==")
+authFile.flush()
+
+benchmarkResults=[]
+print("script,run,wallSeconds,requests,errors,megabytesSent,peakMegabytes,exitStatus")
+for scriptName in args.scripts.split(','):
+    if scriptName not in scriptNames:
+        sys.stderr.write("unknown script "+scriptName+"\n")
+        continue
+    command=scriptCommand(scriptName,args,authFile.name)
+    for runNumber in range(1,args.runs+1):
+        if args.keepOutput:
+            outputFile=open(scriptName+"_"+str(runNumber)+".out",'w')
+        else:
+            outputFile=tempfile.TemporaryFile()
+        runResult=runScript(scriptName,command,mockServer,outputFile)
+        outputFile.close()
+        runResult['run']=runNumber
+        benchmarkResults.append(runResult)
+        print(scriptName+","+str(runNumber)+","+"%.2f"%runResult['wallTime']+","+str(runResult['requests'])+","+str(runResult['errors'])+","+
+              "%.2f"%(runResult['bytes']/1048576.0)+","+"%.1f"%(runResult['peakMemory']/1048576.0)+","+str(runResult['exitStatus']))
+        sys.stdout.flush()
+authFile.close()
+mockServer.shutdown()
+
+if args.jsonFile != '':
+    jsonOut=open(args.jsonFile,'w')
+    json.dump({'scope':{'packages':args.packages,'revisions':args.revisions,'entities':args.entities,'records':args.records,
+                        'latency':args.latency,'errorRate':args.errorRate},
+               'runs':benchmarkResults},jsonOut,indent=2)
+    jsonOut.close()
@@ -0,0 +1,638 @@
+#!/usr/bin/python
+# Shared helpers for counting PASTA audit records. Used by
+# PastaUseCountBasic.py, PastaUseCountwUsers.py and PASTAsummary.py
+
+import urllib2
+import sys,math,socket,sqlite3,threading
+from datetime import datetime,timedelta
+from multiprocessing.pool import ThreadPool
+import xml.etree.ElementTree as ET
+import pastaClient
+
+DEBUG=0
+
+pastaAuditUrl="http://pasta.lternet.edu/audit/report"
+pastaResourceUrl="https://pasta.lternet.edu/package"
+
+# number of audit records to ask for in each request of a scope harvest
+auditPageSize=10000
+
+# an audit query is first asked for its whole period. If that takes longer
+# than shardTimeOut seconds the period is split into shards of shardDays,
+# fetched at the same time by shardWorkers threads. A shard that times out
+# in turn is split in two and tried again, down to shards of minShardHours
+shardDays=31
+shardTimeOut=60
+minShardHours=6
+shardWorkers=4
+
+def metadataResourceId(pastaScope,pastaId,pastaVersion):
+    return(pastaResourceUrl+"/metadata/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion))
+
+def entityResourceId(pastaScope,pastaId,pastaVersion,pastaEntity):
+    return(pastaResourceUrl+"/data/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion)+"/"+pastaEntity)
+
+# (pastaId,pastaVersion) of the package revision a resourceId of the scope
+# belongs to (metadata, data entity, package ...), or None
+def resourceRevision(pastaScope,resourceId):
+    pathParts=resourceId.split('/')
+    if 'eml' not in pathParts:
+        return(None)
+    emlIndex=pathParts.index('eml')
+    if pathParts[emlIndex+1:emlIndex+2] != [pastaScope] or len(pathParts) < emlIndex+4:
+        return(None)
+    return((pathParts[emlIndex+2],pathParts[emlIndex+3]))
+
+def revisionSet(pastaScope,resourceIds):
+    activeRevisions=set()
+    for resourceId in resourceIds:
+        packageRevision=resourceRevision(pastaScope,resourceId)
+        if packageRevision is not None:
+            activeRevisions.add(packageRevision)
+    return(activeRevisions)
+
+# Times may be given as 2013-12-30 or 2013-11-18T13:05:00. Write dates
+# with a time so they sort correctly against audit record entryTimes
+def fullTime(pastaTime):
+    if pastaTime == '':
+        return(datetime.today().strftime("%Y-%m-%dT%H:%M:%S"))
+    if 'T' not in pastaTime:
+        return(pastaTime+"T00:00:00")
+    return(pastaTime)
+
+# Entity counts are kept as [number of records, number of downloads that
+# did not fail with a 401 code, dictionary of successful downloads by user]
+def newEntityCounts():
+    return([0,0,{'public':0}])
+
+def countEntityRecord(entityCounts,responseStatus,user):
+    entityCounts[0]=entityCounts[0]+1
+# only count if download didn't fail with 401 code
+    if responseStatus != '401':
+        entityCounts[1]=entityCounts[1]+1
+        userArray=entityCounts[2]
+        if user in userArray:
+            userArray[user]=userArray[user]+1
+        else:
+            userArray[user]=1
+
+# Read the auditRecord elements of an audit report one at a time as the
+# report arrives. Each record is freed once the next one is read, so memory
+# use does not depend on the size of the report
+def iterAuditRecords(usock):
+    xmlRoot=None
+    for (event,elem) in ET.iterparse(usock,events=('start','end')):
+        if xmlRoot is None:
+            xmlRoot=elem
+        elif event == 'end' and elem.tag == 'auditRecord':
+            yield(elem)
+            xmlRoot.clear()
+
+def countRecords(auditRecords):
+    recordCount=0
+    for auditRecord in auditRecords:
+        recordCount=recordCount+1
+    return(recordCount)
+
+def addCounts(count1,count2):
+    return(count1+count2)
+
+# Count the downloads in a list (or iterAuditRecords) of readDataEntity audit records
+def tallyEntityRecords(auditRecords):
+    entityCounts=newEntityCounts()
+    for b in auditRecords:
+        countEntityRecord(entityCounts,b.find('./responseStatus').text,b.find('./user').text)
+    return(tuple(entityCounts))
+
+def mergeEntityCounts(entityCounts1,entityCounts2):
+    userArray=dict(entityCounts1[2])
+    for (user,userCount) in entityCounts2[2].items():
+        userArray[user]=userArray.get(user,0)+userCount
+    return((entityCounts1[0]+entityCounts2[0],entityCounts1[1]+entityCounts2[1],userArray))
+
+# datetime.strptime is not safe to call from several threads in python 2
+def parseTime(pastaTime):
+    timeParts=fullTime(pastaTime)[:19].replace('T','-').replace(':','-').split('-')
+    return(datetime(*[int(timePart) for timePart in timeParts]))
+
+## Download histograms. Downloads are counted by day as the records are
+## read (the day is the start of entryTime), and the day counts are added
+## up into days, weeks or months afterwards, so the calendar work is done
+## once for each day rather than for each record
+histogramIntervals=('day','week','month')
+
+# the first day (YYYY-MM-DD) of the day, week (starting Monday) or month holding day
+def periodStart(day,interval):
+    if interval == 'day':
+        return(day)
+    if interval == 'month':
+        return(day[:7]+'-01')
+    dayTime=parseTime(day)
+    return((dayTime-timedelta(days=dayTime.weekday())).strftime("%Y-%m-%d"))
+
+# every period between two times, in order, including those without downloads
+def histogramPeriods(fromTime,toTime,interval):
+    periods=[]
+    dayTime=parseTime(fullTime(fromTime)[:10])
+    lastDay=fullTime(toTime)[:10]
+    while True:
+        day=dayTime.strftime("%Y-%m-%d")
+        if day > lastDay:
+            break
+        period=periodStart(day,interval)
+        if not periods or periods[-1] != period:
+            periods.append(period)
+        dayTime=dayTime+timedelta(days=1)
+    return(periods)
+
+# add up a dictionary of counts by day into a dictionary of counts by period
+def rollupDays(dayCounts,interval):
+    periodCounts={}
+    for (day,dayCount) in dayCounts.items():
+        period=periodStart(day,interval)
+        periodCounts[period]=periodCounts.get(period,0)+dayCount
+    return(periodCounts)
+
+# add the counts of histogram2 to histogram1
+def addHistogram(histogram1,histogram2):
+    for (period,periodCount) in histogram2.items():
+        histogram1[period]=histogram1.get(period,0)+periodCount
+
+# split the period between two times into shardCount equal shards
+def splitWindow(fromTime,toTime,shardCount):
+    startTime=parseTime(fromTime)
+    shardLength=(parseTime(toTime)-startTime)/shardCount
+    shardTimes=[fullTime(fromTime)]
+    for shardNumber in range(1,shardCount):
+        shardTimes.append((startTime+shardLength*shardNumber).strftime("%Y-%m-%dT%H:%M:%S"))
+    shardTimes.append(fullTime(toTime))
+    return(zip(shardTimes[:-1],shardTimes[1:]))
+
+# A shard that timed out, or that the server gave up on with a 504, is too
+# slow and is split. Shards are fetched without retrying these, so the split
+# comes after the first one. Overload answers (429 and 503) are not split:
+# the client has already backed off and retried them
+def isTimeout(error):
+    if isinstance(error,urllib2.HTTPError):
+        return(error.code == 504)
+    if isinstance(error,urllib2.URLError):
+        error=error.reason
+    return(isinstance(error,socket.timeout))
+
+shardPool=None
+shardPoolLock=threading.Lock()
+
+def getShardPool():
+    global shardPool
+    with shardPoolLock:
+        if shardPool is None:
+            shardPool=ThreadPool(shardWorkers)
+    return(shardPool)
+
+# Fetch one shard and tally its records. Each shard except the last only
+# counts records before its toTime, so records on the boundary between two
+# shards are only counted once
+def fetchShard(pastaQueryString,fromTime,toTime,lastShard,userData,tally,timeOut,retryTimeouts):
+    shardQueryString=pastaQueryString+'&fromTime='+fromTime
+    if toTime != '':
+        shardQueryString=shardQueryString+'&toTime='+toTime
+    if DEBUG:
+        sys.stderr.write(shardQueryString+"\n")
+    req=urllib2.Request(shardQueryString)
+    req.add_header('Authorization', userData)
+    usock=pastaClient.urlopen(req,timeout=timeOut,retryTimeouts=retryTimeouts)
+    auditRecords=iterAuditRecords(usock)
+    if not lastShard:
+        auditRecords=(r for r in auditRecords if fullTime(r.find('./entryTime').text) < toTime)
+    shardCounts=tally(auditRecords)
+    usock.close()
+    return(shardCounts)
+
+# fetchShard run on the shard pool. Shards not yet started when another
+# shard of the same query has failed are not fetched
+def fetchPooledShard(cancelled,*shardArgs):
+    if cancelled.is_set():
+        return(None)
+    return(fetchShard(*shardArgs))
+
+# the shards a shard that timed out is split into: shards of shardDays if
+# it is longer than that, otherwise two halves
+def splitShard(fromTime,toTime,lastShard):
+    shardCount=max(2,int(math.ceil((parseTime(toTime)-parseTime(fromTime)).total_seconds()/(shardDays*86400.0))))
+    shards=[(shardFromTime,shardToTime,False) for (shardFromTime,shardToTime) in splitWindow(fromTime,toTime,shardCount)]
+    shards[-1]=(shards[-1][0],shards[-1][1],lastShard)
+    return(shards)
+
+# Answer an audit query (pastaQueryString without fromTime or toTime) for a
+# period. The whole period is asked for first. If it times out it is split
+# into shards fetched in parallel, shards that time out are split again, and
+# tally(auditRecords) for each shard is combined using merge(counts1,counts2)
+def shardedAuditCounts(pastaQueryString,pastaFromTime,pastaToTime,userData,tally,merge):
+    shards=[(pastaFromTime,pastaToTime,True)]
+    totalCounts=None
+    cancelled=threading.Event()
+    while len(shards) > 0:
+        # timeouts are not retried, overloads get the client's usual backoff
+        if len(shards) == 1:
+            shardResults=[(shards[0],None)]
+        else:
+            shardResults=[(shard,getShardPool().apply_async(fetchPooledShard,(cancelled,pastaQueryString,shard[0],shard[1],shard[2],userData,tally,shardTimeOut,False))) for shard in shards]
+        shards=[]
+        try:
+            for ((fromTime,toTime,lastShard),shardResult) in shardResults:
+                try:
+                    if shardResult is None:
+                        shardCounts=fetchShard(pastaQueryString,fromTime,toTime,lastShard,userData,tally,shardTimeOut,False)
+                    else:
+                        shardCounts=shardResult.get()
+                except (socket.error,urllib2.URLError),e:
+                    if not isTimeout(e):
+                        raise
+                    if (parseTime(toTime)-parseTime(fromTime)).total_seconds() > 2*minShardHours*3600:
+                        if DEBUG:
+                            sys.stderr.write("splitting audit query shard "+fromTime+" to "+toTime+"\n")
+                        shards.extend(splitShard(fromTime,toTime,lastShard))
+                        continue
+                    # last try for a shard too small to split, with the client's usual timeout and retries
+                    shardCounts=fetchShard(pastaQueryString,fromTime,toTime,lastShard,userData,tally,None,True)
+                if totalCounts is None:
+                    totalCounts=shardCounts
+                else:
+                    totalCounts=merge(totalCounts,shardCounts)
+        except:
+            # stop the shards not yet started and wait for the ones running,
+            # so none keep going after the query has failed
+            error=sys.exc_info()
+            cancelled.set()
+            for (shard,shardResult) in shardResults:
+                if shardResult is not None:
+                    shardResult.wait()
+            raise error[0],error[1],error[2]
+    return(totalCounts)
+
+# Harvests all the audit records for a scope and period using a few large
+# requests, then answers the same questions as metadataUseCount and
+# entityAuditCounts in the reporting scripts from the records grouped by
+# resourceId, so no request is needed for each package or entity.
+class ScopeAudit:
+
+    def __init__(self,pastaScope,pastaFromTime,pastaToTime,userData,pageSize=auditPageSize,timeOut=160):
+        self.pastaScope=pastaScope
+        self.pastaFromTime=pastaFromTime
+        self.pastaToTime=pastaToTime
+        self.userData=userData
+        self.pageSize=pageSize
+        self.timeOut=timeOut
+        self.requestCount=0
+        # number of audit records of any kind for each resourceId
+        self.resourceCounts={}
+        # counts of readDataEntity audit records for each resourceId
+        self.entityCounts={}
+        # successful readDataEntity downloads of each resourceId by day
+        self.entityDays={}
+
+    def harvest(self):
+        self.harvestWindow(self.pastaFromTime,self.pastaToTime)
+        return(self)
+
+    def harvestWindow(self,fromTime,toTime):
+        # Pages are requested in time order. Each new page starts at the entryTime
+        # of the last record of the page before, so records sharing that time
+        # are skipped using their oid. A short page does not end the window, as
+        # PASTA may return fewer records than the limit asked for; paging stops
+        # at the first page with nothing new, which after a short page that did
+        # end the window is one extra request for the records at its last time
+        boundaryOids=set()
+        pageLimit=self.pageSize
+        # the length of a page PASTA cut short of the limit although more
+        # records followed, i.e. the most it returns at once
+        serverLimit=None
+        shortPage=None
+        while True:
+            pageCount=0
+            newRecords=0
+            lastTime=None
+            lastOids=set()
+            for auditRecord in self.fetchPage(fromTime,toTime,pageLimit):
+                pageCount=pageCount+1
+                oid=auditRecord.find('./oid').text
+                entryTime=auditRecord.find('./entryTime').text
+                if entryTime != lastTime:
+                    lastTime=entryTime
+                    lastOids=set()
+                lastOids.add(oid)
+                if oid in boundaryOids:
+                    continue
+                newRecords=newRecords+1
+                self.addRecord(auditRecord)
+            if pageCount == 0:
+                break
+            if newRecords == 0:
+                # Only records at fromTime that were seen already. If the page
+                # is full there may be more records at that time than a page
+                # holds, so a longer page is asked for. If PASTA won't return
+                # more the rest can't be paged to, and the harvest fails
+                # rather than leave them out
+                if pageCount >= pageLimit:
+                    pageLimit=pageLimit*2
+                    continue
+                if serverLimit is not None and pageCount >= serverLimit:
+                    raise RuntimeError(str(pageCount)+" or more audit records of scope "+self.pastaScope+" at "+fromTime+", more than PASTA returns in one request")
+                break
+            if shortPage is not None:
+                serverLimit=shortPage
+            shortPage=None
+            if pageCount < pageLimit:
+                shortPage=pageCount
+            if lastTime != fromTime:
+                pageLimit=self.pageSize
+            fromTime=lastTime
+            boundaryOids=lastOids
+
+    def fetchPage(self,fromTime,toTime,pageLimit):
+        pastaQueryString=pastaAuditUrl+'/?scope='+self.pastaScope+'&fromTime='+fromTime
+        if toTime != '':
+            pastaQueryString=pastaQueryString+'&toTime='+toTime
+        pastaQueryString=pastaQueryString+'&limit='+str(pageLimit)
+        if DEBUG:
+            sys.stderr.write(pastaQueryString+"\n")
+        req=urllib2.Request(pastaQueryString)
+        req.add_header('Authorization', self.userData)
+        usock=pastaClient.urlopen(req,timeout=self.timeOut)
+        self.requestCount=self.requestCount+1
+        for auditRecord in iterAuditRecords(usock):
+            yield(auditRecord)
+        usock.close()
+
+    def addRecord(self,auditRecord):
+        resourceId=auditRecord.find('./resourceId').text
+        self.resourceCounts[resourceId]=self.resourceCounts.get(resourceId,0)+1
+        if auditRecord.find('./serviceMethod').text == 'readDataEntity':
+            if resourceId not in self.entityCounts:
+                self.entityCounts[resourceId]=newEntityCounts()
+            responseStatus=auditRecord.find('./responseStatus').text
+            countEntityRecord(self.entityCounts[resourceId],responseStatus,auditRecord.find('./user').text)
+            if responseStatus != '401':
+                dayCounts=self.entityDays.setdefault(resourceId,{})
+                day=auditRecord.find('./entryTime').text[:10]
+                dayCounts[day]=dayCounts.get(day,0)+1
+
+    # same arguments and results as metadataUseCount in the reporting scripts
+    def metadataUseCount(self,pastaScope,pastaId,pastaVersion):
+        return(self.resourceCounts.get(metadataResourceId(pastaScope,pastaId,pastaVersion),0))
+
+    # same arguments and results as entityAuditCounts in the reporting scripts
+    def entityAuditCounts(self,pastaScope,pastaId,pastaVersion,pastaEntity):
+        entityCounts=self.entityCounts.get(entityResourceId(pastaScope,pastaId,pastaVersion,pastaEntity))
+        if entityCounts is None:
+            entityCounts=newEntityCounts()
+        return(tuple(entityCounts))
+
+    # (pastaId,pastaVersion) of the package revisions of the scope with
+    # audit records of any kind in the period (see pastaPlan.py)
+    def activeRevisions(self):
+        return(revisionSet(self.pastaScope,self.resourceCounts.keys()))
+
+    # package metadata is only kept by an AuditStore
+    def addPackage(self,pastaId,pastaVersion,packageData):
+        pass
+
+    # successful downloads of an entity in each day, week or month (see
+    # periodStart). Periods without downloads are left out
+    def entityHistogram(self,pastaScope,pastaId,pastaVersion,pastaEntity,interval):
+        return(rollupDays(self.entityDays.get(entityResourceId(pastaScope,pastaId,pastaVersion,pastaEntity),{}),interval))
+
+# A ScopeAudit that keeps the audit records in a local SQLite file. For
+# each scope the file remembers the earliest time harvested and the
+# entryTime of the latest record, so later runs only request records
+# outside that range. Counts for any period inside it are answered from
+# the file without using the network.
+class AuditStore(ScopeAudit):
+
+    # with readOnly the file is only queried: its tables are not created and
+    # nothing can be written to it, so it can't be harvested either
+    def __init__(self,storeFile,pastaScope,pastaFromTime,pastaToTime,userData,pageSize=auditPageSize,timeOut=160,readOnly=False):
+        ScopeAudit.__init__(self,pastaScope,pastaFromTime,pastaToTime,userData,pageSize,timeOut)
+        self.storeFile=storeFile
+        self.fromTime=fullTime(pastaFromTime)
+        self.toTime=fullTime(pastaToTime)
+        self.lock=threading.Lock()
+        self.db=sqlite3.connect(storeFile,check_same_thread=False)
+        if readOnly:
+            self.db.execute('pragma query_only=1')
+            return
+        self.db.execute('create table if not exists auditRecord (oid integer primary key, scope text, resourceId text, serviceMethod text, user text, entryTime text, responseStatus text)')
+        self.db.execute('create index if not exists auditRecordResource on auditRecord (resourceId,entryTime)')
+        self.db.execute('create index if not exists auditRecordUser on auditRecord (user,entryTime)')
+        self.db.execute('create index if not exists auditRecordTime on auditRecord (entryTime)')
+        self.db.execute('create table if not exists harvest (scope text primary key, fromTime text, lastEntryTime text)')
+        # title and data entities of the package revisions reported from the
+        # store, so that reports can be made again from the file alone
+        self.db.execute('create table if not exists package (scope text, identifier integer, revision integer, title text, primary key (scope,identifier,revision))')
+        self.db.execute('create table if not exists entity (scope text, identifier integer, revision integer, entityNumber integer, entityId text, entityName text, primary key (scope,identifier,revision,entityNumber))')
+        self.db.commit()
+
+    def harvest(self):
+        row=self.db.execute('select fromTime,lastEntryTime from harvest where scope=?',(self.pastaScope,)).fetchone()
+        if row is None:
+            self.harvestWindow(self.fromTime,self.toTime)
+            harvestFrom=self.fromTime
+        else:
+            (harvestFrom,lastEntryTime)=row
+            if self.fromTime < harvestFrom:
+                self.harvestWindow(self.fromTime,harvestFrom)
+                harvestFrom=self.fromTime
+            if self.toTime > lastEntryTime:
+                self.harvestWindow(lastEntryTime,self.toTime)
+        lastEntryTime=self.db.execute('select max(entryTime) from auditRecord where scope=?',(self.pastaScope,)).fetchone()[0]
+        if lastEntryTime is None:
+            lastEntryTime=harvestFrom
+        self.db.execute('insert or replace into harvest values (?,?,?)',(self.pastaScope,harvestFrom,lastEntryTime))
+        self.db.commit()
+        return(self)
+
+    def harvestWindow(self,fromTime,toTime):
+        ScopeAudit.harvestWindow(self,fromTime,toTime)
+        self.db.commit()
+
+    def addRecord(self,auditRecord):
+        # records already in the file have the same oid and are ignored
+        self.db.execute('insert or ignore into auditRecord values (?,?,?,?,?,?,?)',
+            (int(auditRecord.find('./oid').text),self.pastaScope,
+             auditRecord.find('./resourceId').text,auditRecord.find('./serviceMethod').text,
+             auditRecord.find('./user').text,auditRecord.find('./entryTime').text,
+             auditRecord.find('./responseStatus').text))
+
+    def metadataUseCount(self,pastaScope,pastaId,pastaVersion):
+        with self.lock:
+            return(self.db.execute('select count(*) from auditRecord where resourceId=? and entryTime>=? and entryTime<=?',
+                (metadataResourceId(pastaScope,pastaId,pastaVersion),self.fromTime,self.toTime)).fetchone()[0])
+
+    def entityAuditCounts(self,pastaScope,pastaId,pastaVersion,pastaEntity):
+        entityCounts=newEntityCounts()
+        with self.lock:
+            rows=self.db.execute("select user,responseStatus,count(*) from auditRecord where resourceId=? and serviceMethod='readDataEntity' and entryTime>=? and entryTime<=? group by user,responseStatus",
+                (entityResourceId(pastaScope,pastaId,pastaVersion,pastaEntity),self.fromTime,self.toTime)).fetchall()
+        for (user,responseStatus,recordCount) in rows:
+            entityCounts[0]=entityCounts[0]+recordCount
+            if responseStatus != '401':
+                entityCounts[1]=entityCounts[1]+recordCount
+                entityCounts[2][user]=entityCounts[2].get(user,0)+recordCount
+        return(tuple(entityCounts))
+
+    def activeRevisions(self):
+        with self.lock:
+            rows=self.db.execute('select distinct resourceId from auditRecord where scope=? and entryTime>=? and entryTime<=?',
+                (self.pastaScope,self.fromTime,self.toTime)).fetchall()
+        return(revisionSet(self.pastaScope,[row[0] for row in rows]))
+
+    # remember the title and entities (from pastaCache.packageInfo) of a package revision
+    def addPackage(self,pastaId,pastaVersion,packageData):
+        packageKey=(self.pastaScope,int(pastaId),int(pastaVersion))
+        with self.lock:
+            self.db.execute('insert or replace into package values (?,?,?,?)',packageKey+(packageData['title'],))
+            self.db.execute('delete from entity where scope=? and identifier=? and revision=?',packageKey)
+            self.db.executemany('insert into entity values (?,?,?,?,?,?)',
+                [packageKey+(entityNumber,pastaEntity,entityName) for (entityNumber,(entityName,pastaEntity)) in enumerate(packageData['entities'])])
+            self.db.commit()
+
+    # the package revisions kept in the file, as pastaCache.packageInfo
+    # dictionaries plus pastaId and pastaVersion, in the order of a report:
+    # identifiers in order, most recent revision first
+    def storedPackages(self,pastaId='',pastaVersion=''):
+        packageQuery='select identifier,revision,title from package where scope=?'
+        queryArgs=[self.pastaScope]
+        if pastaId != '':
+            packageQuery=packageQuery+' and identifier=?'
+            queryArgs.append(int(pastaId))
+        if pastaVersion != '':
+            packageQuery=packageQuery+' and revision=?'
+            queryArgs.append(int(pastaVersion))
+        with self.lock:
+            packageRows=self.db.execute(packageQuery+' order by identifier,revision desc',queryArgs).fetchall()
+        for (identifier,revision,title) in packageRows:
+            with self.lock:
+                entityRows=self.db.execute('select entityName,entityId from entity where scope=? and identifier=? and revision=? order by entityNumber',
+                    (self.pastaScope,identifier,revision)).fetchall()
+            yield({'packageId':self.pastaScope+"."+str(identifier)+"."+str(revision),
+                   'pastaId':str(identifier),
+                   'pastaVersion':str(revision),
+                   'title':title,
+                   'entities':entityRows})
+
+    # (earliest time, latest entryTime) of the records harvested for the
+    # scope, or None if it has not been harvested
+    def harvestedPeriod(self):
+        with self.lock:
+            return(self.db.execute('select fromTime,lastEntryTime from harvest where scope=?',(self.pastaScope,)).fetchone())
+
+    def entityHistogram(self,pastaScope,pastaId,pastaVersion,pastaEntity,interval):
+        with self.lock:
+            rows=self.db.execute("select substr(entryTime,1,10),count(*) from auditRecord where resourceId=? and serviceMethod='readDataEntity' and responseStatus!='401' and entryTime>=? and entryTime<=? group by substr(entryTime,1,10)",
+                (entityResourceId(pastaScope,pastaId,pastaVersion,pastaEntity),self.fromTime,self.toTime)).fetchall()
+        return(rollupDays(dict(rows),interval))
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+# Writes the audit records behind a report, and the counts made from them,
+# to an SQLite file for later analysis. The auditRecord table has the same
+# columns as in an AuditStore, with typed values and indexes for selecting
+# by resource, user or time. Records are written in batches as they are
+# read, and records seen twice (e.g. on a shard boundary) are kept once.
+#
+# auditExport=AuditExport('export.sqlite',pastaScope,pastaFromTime,pastaToTime)
+# tally=auditExport.exportingTally(tallyEntityRecords)   # use in place of tally
+# auditExport.close()
+class AuditExport:
+
+    def __init__(self,exportFile,pastaScope,pastaFromTime,pastaToTime,batchSize=1000):
+        self.exportFile=exportFile
+        self.pastaScope=pastaScope
+        self.fromTime=fullTime(pastaFromTime)
+        self.toTime=fullTime(pastaToTime)
+        self.batchSize=batchSize
+        self.lock=threading.Lock()
+        self.batch=[]
+        self.recordCount=0
+        self.db=sqlite3.connect(exportFile,check_same_thread=False)
+        self.db.execute('create table if not exists auditRecord (oid integer primary key, scope text, resourceId text, serviceMethod text, user text, entryTime text, responseStatus integer)')
+        self.db.execute('create index if not exists auditRecordResource on auditRecord (resourceId,entryTime)')
+        self.db.execute('create index if not exists auditRecordUser on auditRecord (user,entryTime)')
+        self.db.execute('create index if not exists auditRecordTime on auditRecord (entryTime)')
+        # one row per package revision and per data entity, with the counts
+        # of the report, and one row per user of each entity
+        self.db.execute('create table if not exists package (scope text, identifier integer, revision integer, title text, metadataDownloadCount integer, fromTime text, toTime text, primary key (scope,identifier,revision,fromTime,toTime))')
+        self.db.execute('create table if not exists entity (scope text, identifier integer, revision integer, entityId text, entityName text, recordCount integer, downloadCount integer, userCount integer, fromTime text, toTime text, primary key (scope,identifier,revision,entityId,fromTime,toTime))')
+        self.db.execute('create table if not exists entityUser (scope text, identifier integer, revision integer, entityId text, user text, downloadCount integer, fromTime text, toTime text, primary key (scope,identifier,revision,entityId,user,fromTime,toTime))')
+        self.db.execute('create index if not exists entityUserUser on entityUser (user)')
+        self.db.commit()
+
+    def addRecord(self,auditRecord):
+        recordValues=(int(auditRecord.find('./oid').text),self.pastaScope,
+                      auditRecord.find('./resourceId').text,auditRecord.find('./serviceMethod').text,
+                      auditRecord.find('./user').text,auditRecord.find('./entryTime').text,
+                      int(auditRecord.find('./responseStatus').text))
+        with self.lock:
+            self.batch.append(recordValues)
+            if len(self.batch) >= self.batchSize:
+                self.flush()
+
+    # write the waiting records. Called with the lock held
+    def flush(self):
+        if self.batch:
+            changesBefore=self.db.total_changes
+            self.db.executemany('insert or ignore into auditRecord values (?,?,?,?,?,?,?)',self.batch)
+            self.db.commit()
+            self.recordCount=self.recordCount+self.db.total_changes-changesBefore
+            self.batch=[]
+
+    # a tally (see shardedAuditCounts) that also writes each record it counts
+    def exportingTally(self,tally):
+        def exportRecords(auditRecords):
+            for auditRecord in auditRecords:
+                self.addRecord(auditRecord)
+                yield(auditRecord)
+        def exportingTally(auditRecords):
+            return(tally(exportRecords(auditRecords)))
+        return(exportingTally)
+
+    # copy the records of the scope and period from an AuditStore file
+    def copyStore(self,auditStore):
+        with self.lock:
+            self.flush()
+            self.db.execute('attach database ? as store',(auditStore.storeFile,))
+            copied=self.db.execute('insert or ignore into auditRecord select oid,scope,resourceId,serviceMethod,user,entryTime,cast(responseStatus as integer) from store.auditRecord where scope=? and entryTime>=? and entryTime<=?',
+                (self.pastaScope,self.fromTime,self.toTime)).rowcount
+            self.db.commit()
+            self.db.execute('detach database store')
+            self.recordCount=self.recordCount+copied
+
+    def addPackage(self,pastaId,pastaVersion,title,metadataDownloadCount):
+        with self.lock:
+            self.db.execute('insert or replace into package values (?,?,?,?,?,?,?)',
+                (self.pastaScope,int(pastaId),int(pastaVersion),title,metadataDownloadCount,self.fromTime,self.toTime))
+
+    # entityCounts as returned by entityAuditCounts. It is None when the audit report failed, and the counts are written as NULL
+    def addEntity(self,pastaId,pastaVersion,pastaEntity,entityName,entityCounts):
+        entityKey=(self.pastaScope,int(pastaId),int(pastaVersion),pastaEntity)
+        if entityCounts is None:
+            with self.lock:
+                self.db.execute('insert or replace into entity values (?,?,?,?,?,?,?,?,?,?)',
+                    entityKey+(entityName,None,None,None,self.fromTime,self.toTime))
+            return
+        (recordCount,downloadCount,userArray)=entityCounts
+        userCounts=[(user,userCount) for (user,userCount) in userArray.items() if userCount > 0]
+        with self.lock:
+            self.db.execute('insert or replace into entity values (?,?,?,?,?,?,?,?,?,?)',
+                entityKey+(entityName,recordCount,downloadCount,len(userCounts),self.fromTime,self.toTime))
+            self.db.executemany('insert or replace into entityUser values (?,?,?,?,?,?,?,?)',
+                [entityKey+(user,userCount,self.fromTime,self.toTime) for (user,userCount) in userCounts])
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+# Fetches the metadata needed by the PASTA reporting scripts for a
+# package revision (title, contact emails and data entity names and ids)
+# and keeps those fields in a local SQLite cache. Published PASTA
+# revisions never change, so a revision only needs to be downloaded once.
+# The EML itself is not kept: it is parsed as it downloads and only as far
+# as those fields go, so large documents are never held in memory whole.
+
+import urllib2
+import sys,time,json,sqlite3,threading,StringIO
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+import pastaClient
+
+DEBUG=0
+
+pastaPackageUrl="http://pasta.lternet.edu/package"
+
+# default largest size of the cache in megabytes
+defaultCacheSize=500
+
+# The EML left after the fields needed is read and dropped if it is no more
+# than this many bytes, so the connection is kept for the next request.
+# Bigger documents are cut off, at the cost of a new connection
+emlDrainBytes=256*1024
+
+# layout of the cache file, kept in its user_version. Files from before
+# version 2 also have the EML of each revision, which is dropped from them
+cacheVersion=2
+packageColumns='(packageId text primary key, title text, contacts text, entities text, size integer, lastUsed real)'
+
+class PackageCache:
+
+    def __init__(self,cacheFile,maxSize=defaultCacheSize):
+        self.maxBytes=maxSize*1024*1024
+        self.lock=threading.Lock()
+        self.db=sqlite3.connect(cacheFile,check_same_thread=False)
+        if self.db.execute('pragma user_version').fetchone()[0] < cacheVersion:
+            self.upgrade()
+        self.db.execute('create table if not exists package '+packageColumns)
+        self.db.execute('create index if not exists packageLastUsed on package (lastUsed)')
+        self.db.commit()
+
+    # copy the revisions of an older cache file into the current layout
+    def upgrade(self):
+        columnNames=[column[1] for column in self.db.execute('pragma table_info(package)')]
+        if 'eml' in columnNames:
+            self.db.execute('create table packageUpgrade '+packageColumns)
+            self.db.execute("insert into packageUpgrade select packageId,title,contacts,entities,length(contacts)+length(entities)+length(coalesce(title,'')),lastUsed from package")
+            self.db.execute('drop table package')
+            self.db.execute('alter table packageUpgrade rename to package')
+            self.db.commit()
+            # give the space of the EML back
+            self.db.execute('vacuum')
+        self.db.execute('pragma user_version='+str(cacheVersion))
+        self.db.commit()
+
+    def get(self,packageId):
+        with self.lock:
+            row=self.db.execute('select title,contacts,entities from package where packageId=?',(packageId,)).fetchone()
+            if row is None:
+                return(None)
+            self.db.execute('update package set lastUsed=? where packageId=?',(time.time(),packageId))
+            self.db.commit()
+        (title,contacts,entities)=row
+        return({'packageId':packageId,
+                'title':title,
+                'contacts':json.loads(contacts),
+                'entities':[tuple(entity) for entity in json.loads(entities)]})
+
+    def put(self,packageInfo):
+        contacts=json.dumps(packageInfo['contacts'])
+        entities=json.dumps(packageInfo['entities'])
+        size=len(contacts)+len(entities)+len(packageInfo['title'] or '')
+        with self.lock:
+            self.db.execute('insert or replace into package values (?,?,?,?,?,?)',
+                (packageInfo['packageId'],packageInfo['title'],contacts,entities,size,time.time()))
+            self.evict()
+            self.db.commit()
+
+    # remove the least recently used packages until the cache fits in maxBytes
+    def evict(self):
+        totalSize=self.db.execute('select coalesce(sum(size),0) from package').fetchone()[0]
+        if totalSize <= self.maxBytes:
+            return
+        for (packageId,size) in self.db.execute('select packageId,size from package order by lastUsed').fetchall():
+            self.db.execute('delete from package where packageId=?',(packageId,))
+            totalSize=totalSize-size
+            if totalSize <= self.maxBytes:
+                break
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+def openUrl(url,userData,timeOut):
+    req=urllib2.Request(url)
+    req.add_header('Authorization', userData)
+    return(pastaClient.urlopen(req,timeout=timeOut))
+
+def closeEml(usock):
+    if isinstance(usock,pastaClient.PastaResponse):
+        usock.drain(emlDrainBytes)
+    usock.close()
+
+def readUrl(url,userData,timeOut):
+    usock=openUrl(url,userData,timeOut)
+    urlString=usock.read()
+    if(DEBUG==1):
+        sys.stderr.write("url: "+str(usock.geturl())+"\n")
+        sys.stderr.write("HTML return code: "+str(usock.getcode())+"\n")
+        sys.stderr.write(str(usock.info()))
+        sys.stderr.write(urlString+"\n")
+    usock.close()
+    return(urlString)
+
+# Read the dataset title, the contact emails and the first entityCount
+# entityNames (anywhere in the document, in order) from an EML document
+# as it downloads. Each element is cleared as soon as it ends, so the
+# attribute lists of large data tables are never kept. The children of
+# dataset come in a fixed order in EML: the title, then the contacts
+# before the publisher, methods and data entities. Reading stops once
+# the contacts are finished and entityCount entityNames have been found
+def readPackageFields(emlFile,entityCount):
+    title=None
+    contactEmails=[]
+    entityNames=[]
+    inContacts=False
+    contactsDone=False
+    path=[]
+    for (event,element) in ET.iterparse(emlFile,events=('start','end')):
+        if event == 'start':
+            path.append(element.tag)
+            if len(path) == 3 and path[1] == 'dataset':
+                if element.tag == 'contact':
+                    inContacts=True
+                elif inContacts:
+                    contactsDone=True
+                    if len(entityNames) >= entityCount:
+                        break
+            continue
+        if len(path) == 3 and path[1:] == ['dataset','title'] and title is None:
+            title=element.text
+        elif len(path) == 4 and path[1:] == ['dataset','contact','electronicMailAddress']:
+            contactEmails.append(element.text)
+        elif element.tag == 'entityName':
+            entityNames.append(element.text)
+            if contactsDone and len(entityNames) >= entityCount:
+                break
+        element.clear()
+        path.pop()
+    return((title,contactEmails,entityNames))
+
+# Pull what the reporting scripts use out of an EML document (a string or
+# an open url) and the list of data entity ids for the package
+def parsePackage(packageId,emlFile,pastaEntitiesId):
+    if isinstance(emlFile,basestring):
+        emlFile=StringIO.StringIO(emlFile)
+    pastaEntities=pastaEntitiesId.split()
+    (title,contactEmails,entityNames)=readPackageFields(emlFile,len(pastaEntities))
+    entities=[]
+    entityCounter=0
+    for pastaEntity in pastaEntities:
+        entities.append((entityNames[entityCounter],pastaEntity))
+        entityCounter=entityCounter+1
+    return({'packageId':packageId,
+            'title':title,
+            'contacts':contactEmails,
+            'entities':entities})
+
+# Returns a dictionary with the packageId, title, contacts (list of
+# emails) and entities (list of entity name and entity id pairs) for a
+# package revision, from the cache if it is there
+def packageInfo(pastaScope,pastaId,pastaVersion,userData,packageCache=None):
+    packageId=pastaScope+"."+str(pastaId)+"."+str(pastaVersion)
+    if packageCache is not None:
+        cachedInfo=packageCache.get(packageId)
+        if cachedInfo is not None:
+            return(cachedInfo)
+    # the entity list comes first, so the EML is only read as far as the
+    # last entityName needed
+    pastaEntitiesId=readUrl(pastaPackageUrl+"/data/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion),userData,60)
+    # liburl2 truncates downloaded data at 32768 bytes if HTTPS used
+    usock=openUrl(pastaPackageUrl+"/metadata/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion),userData,60)
+    newInfo=parsePackage(packageId,usock,pastaEntitiesId)
+    closeEml(usock)
+    if packageCache is not None:
+        packageCache.put(newInfo)
+    return(newInfo)
+
+# Read the contact emails from an EML document as it downloads, stopping
+# at the first element after the contacts
+def readContacts(emlFile):
+    (title,contactEmails,entityNames)=readPackageFields(emlFile,0)
+    return(contactEmails)
+
+# Returns the list of contact emails for a package revision. Only the EML
+# document is downloaded, and only up to the end of the contacts
+def packageContacts(pastaScope,pastaId,pastaVersion,userData,packageCache=None):
+    packageId=pastaScope+"."+str(pastaId)+"."+str(pastaVersion)
+    if packageCache is not None:
+        cachedInfo=packageCache.get(packageId)
+        if cachedInfo is not None:
+            return(cachedInfo['contacts'])
+    usock=openUrl(pastaPackageUrl+"/metadata/eml/"+pastaScope+"/"+str(pastaId)+"/"+str(pastaVersion),userData,60)
+    contactEmails=readContacts(usock)
+    closeEml(usock)
+    return(contactEmails)
@@ -0,0 +1,290 @@
+#!/usr/bin/python
+# Shared HTTP client for the PASTA reporting scripts. Connections are kept
+# open (keep-alive) and reused for later requests to the same host, and
+# failed requests are retried with a growing, randomized wait that honors
+# any Retry-After header sent by the server.
+#
+# urlopen(req,timeout) can be used in place of urllib2.urlopen. It takes a
+# urllib2.Request or a url and returns an object with the same read,
+# readlines, geturl, getcode, info and close methods. Errors are raised as
+# urllib2.HTTPError or urllib2.URLError, as urllib2 does. status(req,timeout)
+# returns just the HTTP status code of a url. Each request is counted in
+# pastaStats.runStats under the kind of endpoint it went to.
+
+import urllib,urllib2,httplib
+import sys,socket,time,random,threading,urlparse
+from StringIO import StringIO
+from email.utils import parsedate_tz,mktime_tz
+import pastaStats
+
+DEBUG=0
+
+# HTTP codes worth trying again
+retryCodes=(429,500,502,503,504)
+redirectCodes=(301,302,303,307,308)
+
+class PastaResponse:
+
+    def __init__(self,client,poolKey,conn,response,url):
+        self.client=client
+        self.poolKey=poolKey
+        self.conn=conn
+        self.response=response
+        self.url=url
+        self.endpoint=pastaStats.endpointClass(url)
+        self.code=response.status
+        self.msg=response.reason
+        self.headers=response.msg
+
+    def read(self,amt=None):
+        if self.response is None:
+            return('')
+        startTime=time.time()
+        try:
+            if amt is None:
+                data=self.response.read()
+            else:
+                data=self.response.read(amt)
+        except socket.timeout:
+            pastaStats.runStats.recordTimeout(self.endpoint)
+            raise
+        pastaStats.runStats.addBytes(self.endpoint,len(data),time.time()-startTime)
+        # once the whole body has been read the connection can be used again
+        if self.response.isclosed():
+            self.release()
+        return(data)
+
+    # read and drop the rest of the body if no more than maxBytes of it are
+    # left, so that close keeps the connection for reuse instead of closing it
+    def drain(self,maxBytes):
+        if self.response is None or (self.response.length is not None and self.response.length > maxBytes):
+            return
+        drained=0
+        while not self.response.isclosed() and drained <= maxBytes:
+            data=self.read(min(65536,maxBytes+1-drained))
+            if data == '':
+                break
+            drained=drained+len(data)
+
+    def readlines(self):
+        return(self.read().splitlines(True))
+
+    def geturl(self):
+        return(self.url)
+
+    def getcode(self):
+        return(self.code)
+
+    def info(self):
+        return(self.headers)
+
+    def release(self):
+        if self.conn is not None:
+            self.client.releaseConnection(self.poolKey,self.conn)
+            self.conn=None
+
+    def close(self):
+        if self.response is not None and not self.response.isclosed():
+            # the rest of the body was not wanted, so the connection can't be reused
+            self.response.close()
+            if self.conn is not None:
+                self.conn.close()
+                self.conn=None
+        self.release()
+        self.response=None
+
+class PastaClient:
+
+    def __init__(self,timeOut=160,retries=4,backoff=1.0,maxBackoff=60.0,poolSize=8,maxRedirects=5):
+        self.timeOut=timeOut
+        self.retries=retries
+        self.backoff=backoff
+        self.maxBackoff=maxBackoff
+        self.poolSize=poolSize
+        self.maxRedirects=maxRedirects
+        self.lock=threading.Lock()
+        # idle connections for each (scheme,host,port,proxy)
+        self.idleConnections={}
+
+    def getConnection(self,poolKey,timeOut):
+        with self.lock:
+            idle=self.idleConnections.get(poolKey)
+            if idle:
+                conn=idle.pop()
+                conn.timeout=timeOut
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeOut)
+                return((conn,True))
+        (scheme,host,port,proxy)=poolKey
+        if proxy is not None:
+            (proxyHost,proxyPort)=proxy
+            if scheme == 'https':
+                conn=httplib.HTTPSConnection(proxyHost,proxyPort,timeout=timeOut)
+                conn.set_tunnel(host,port)
+            else:
+                conn=httplib.HTTPConnection(proxyHost,proxyPort,timeout=timeOut)
+        elif scheme == 'https':
+            conn=httplib.HTTPSConnection(host,port,timeout=timeOut)
+        else:
+            conn=httplib.HTTPConnection(host,port,timeout=timeOut)
+        return((conn,False))
+
+    def releaseConnection(self,poolKey,conn):
+        with self.lock:
+            idle=self.idleConnections.setdefault(poolKey,[])
+            if len(idle) < self.poolSize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            for idle in self.idleConnections.values():
+                for conn in idle:
+                    conn.close()
+            self.idleConnections={}
+
+    # how long to wait before the next try. Retry-After is used if given,
+    # otherwise the wait doubles with each try, randomized so that many
+    # workers don't all retry at the same moment
+    def retryDelay(self,attempt,retryAfter=None):
+        if retryAfter:
+            delay=None
+            try:
+                delay=float(retryAfter)
+            except ValueError:
+                retryDate=parsedate_tz(retryAfter)
+                if retryDate is not None:
+                    delay=mktime_tz(retryDate)-time.time()
+            if delay is not None:
+                return(max(0.0,min(delay,self.maxBackoff)))
+        delay=min(self.maxBackoff,self.backoff*(2**attempt))
+        return(delay/2+random.uniform(0,delay/2))
+
+    # With retryTimeouts False a request that times out, or that the server
+    # gave up on with a 504, fails at once instead of being tried again, for
+    # callers that would rather ask for less than wait for it again
+    def urlopen(self,req,timeout=None,retries=None,retryTimeouts=True):
+        if isinstance(req,basestring):
+            req=urllib2.Request(req)
+        if timeout is None:
+            timeout=self.timeOut
+        if retries is None:
+            retries=self.retries
+        url=req.get_full_url()
+        if urlparse.urlsplit(url).scheme not in ('http','https'):
+            return(urllib2.urlopen(req,timeout=timeout))
+        method=req.get_method()
+        headers=dict(req.header_items())
+        body=req.get_data()
+        attempt=0
+        redirects=0
+        while True:
+            endpoint=pastaStats.endpointClass(url)
+            startTime=time.time()
+            try:
+                response=self.sendRequest(method,url,headers,body,timeout)
+            except (socket.error,httplib.HTTPException),e:
+                if isinstance(e,socket.timeout):
+                    pastaStats.runStats.recordTimeout(endpoint)
+                if attempt >= retries or (isinstance(e,socket.timeout) and not retryTimeouts):
+                    pastaStats.runStats.recordError(endpoint)
+                    raise urllib2.URLError(e)
+                pastaStats.runStats.recordRetry(endpoint)
+                delay=self.retryDelay(attempt)
+                sys.stderr.write("Retrying url request ("+str(e)+") in "+"%.1f"%delay+" seconds\n")
+                time.sleep(delay)
+                attempt=attempt+1
+                continue
+            pastaStats.runStats.recordRequest(endpoint,time.time()-startTime)
+            code=response.getcode()
+            if code in redirectCodes and redirects < self.maxRedirects:
+                location=response.info().getheader('Location')
+                response.read()
+                response.close()
+                if location is None:
+                    raise urllib2.HTTPError(url,code,response.msg,response.info(),None)
+                url=urlparse.urljoin(url,location)
+                if code == 303:
+                    method='GET'
+                    body=None
+                redirects=redirects+1
+                continue
+            if code in retryCodes and attempt < retries and (code != 504 or retryTimeouts):
+                retryAfter=response.info().getheader('Retry-After')
+                response.read()
+                response.close()
+                pastaStats.runStats.recordRetry(endpoint)
+                delay=self.retryDelay(attempt,retryAfter)
+                sys.stderr.write("Retrying url request (HTTP "+str(code)+") in "+"%.1f"%delay+" seconds\n")
+                time.sleep(delay)
+                attempt=attempt+1
+                continue
+            if code >= 400:
+                pastaStats.runStats.recordError(endpoint)
+                errorBody=StringIO(response.read())
+                response.close()
+                raise urllib2.HTTPError(url,code,response.msg,response.info(),errorBody)
+            return(response)
+
+    # HTTP status code of a url, found without downloading the body. HEAD
+    # is used, or a GET whose body is not read if the server doesn't allow HEAD
+    def status(self,req,timeout=None,retries=None):
+        if isinstance(req,basestring):
+            req=urllib2.Request(req)
+        headReq=urllib2.Request(req.get_full_url(),headers=dict(req.header_items()))
+        headReq.get_method=lambda: 'HEAD'
+        for probeReq in (headReq,req):
+            try:
+                response=self.urlopen(probeReq,timeout,retries)
+                response.close()
+                return(response.getcode())
+            except urllib2.HTTPError,e:
+                if probeReq is headReq and e.code in (405,501):
+                    continue
+                return(e.code)
+
+    def sendRequest(self,method,url,headers,body,timeOut):
+        parts=urlparse.urlsplit(url)
+        scheme=parts.scheme
+        host=parts.hostname
+        port=parts.port
+        if port is None:
+            port=443 if scheme == 'https' else 80
+        selector=parts.path or '/'
+        if parts.query:
+            selector=selector+'?'+parts.query
+        proxy=None
+        proxyUrl=urllib.getproxies().get(scheme)
+        if proxyUrl and not urllib.proxy_bypass(host):
+            proxyParts=urlparse.urlsplit(proxyUrl)
+            proxy=(proxyParts.hostname,proxyParts.port or 80)
+            if scheme == 'http':
+                selector=url
+        poolKey=(scheme,host,port,proxy)
+        while True:
+            (conn,reused)=self.getConnection(poolKey,timeOut)
+            if DEBUG:
+                sys.stderr.write(method+" "+url+(" (reused connection)" if reused else "")+"\n")
+            try:
+                conn.request(method,selector,body,headers)
+                response=conn.getresponse()
+            except (socket.error,httplib.HTTPException):
+                conn.close()
+                # a kept-alive connection may have been closed by the server while idle
+                if reused:
+                    continue
+                raise
+            pastaResponse=PastaResponse(self,poolKey,conn,response,url)
+            if method == 'HEAD' or response.isclosed():
+                pastaResponse.release()
+            return(pastaResponse)
+
+# client shared by everything in one run of a script
+defaultClient=PastaClient()
+
+def urlopen(req,timeout=None,retries=None,retryTimeouts=True):
+    return(defaultClient.urlopen(req,timeout,retries,retryTimeouts))
+
+def status(req,timeout=None,retries=None):
+    return(defaultClient.status(req,timeout,retries))
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# Writes the pastaSummaries document of a report to a file one
+# pastaSummary at a time, as each package revision is finished, so the
+# whole scope is never held as an ElementTree. The finished file is the
+# same XML that ET.tostring gave for the whole tree. It can be copied out
+# or parsed by lxml directly, and the summaries of one contact can be
+# read back from it without parsing the rest.
+#
+# summaryDocument=SummaryDocument(pastaFromTime,pastaToTime)
+# summaryNumber=summaryDocument.add(pastaSummaryX)
+# summaryDocument.finish()
+# contactXml=summaryDocument.subDocument([summaryNumber,...])
+
+import shutil,tempfile
+import xml.etree.ElementTree as ET
+
+class SummaryDocument:
+
+    # the document is written to a temporary file, removed when it is closed
+    def __init__(self,pastaFromTime,pastaToTime):
+        self.documentFile=tempfile.TemporaryFile()
+        fromTimeX=ET.Element("fromTime")
+        fromTimeX.text=pastaFromTime
+        toTimeX=ET.Element("toTime")
+        toTimeX.text=pastaToTime
+        self.header=ET.tostring(fromTimeX)+ET.tostring(toTimeX)
+        self.documentFile.write('<pastaSummaries>'+self.header)
+        # (offset,length) in the file of each element added
+        self.elementSpans=[]
+
+    # number the next element added will get
+    def elementCount(self):
+        return(len(self.elementSpans))
+
+    # write an element (e.g. a pastaSummary) to the end of the document and
+    # return its number. The element is not needed after that
+    def add(self,elementX):
+        elementXml=ET.tostring(elementX)
+        self.elementSpans.append((self.documentFile.tell(),len(elementXml)))
+        self.documentFile.write(elementXml)
+        return(len(self.elementSpans)-1)
+
+    # close the document once everything has been added
+    def finish(self):
+        self.documentFile.write('</pastaSummaries>')
+        self.documentFile.flush()
+
+    def element(self,elementNumber):
+        (offset,length)=self.elementSpans[elementNumber]
+        self.documentFile.seek(offset)
+        return(self.documentFile.read(length))
+
+    # a pastaSummaries document with only the numbered elements, in order
+    def subDocument(self,elementNumbers):
+        return('<pastaSummaries>'+self.header+''.join([self.element(elementNumber) for elementNumber in elementNumbers])+'</pastaSummaries>')
+
+    # copy the whole document to outFile a block at a time
+    def copyTo(self,outFile):
+        self.documentFile.seek(0)
+        shutil.copyfileobj(self.documentFile,outFile)
+
+    # the whole document as an open file, e.g. for XSLT_ET.parse
+    def openDocument(self):
+        self.documentFile.seek(0)
+        return(self.documentFile)
+
+    def close(self):
+        self.documentFile.close()
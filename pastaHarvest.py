@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# Walks the packages of a PASTA scope with many requests in flight at
+# once. Each step starts as soon as the step it depends on is finished:
+#
+#   identifier -> list of revisions -> EML and entity list -> one audit
+#                                   -> metadata audit         query per entity
+#
+# and no more than `concurrency` requests run at the same time across the
+# whole walk. Results come back in the same order as a one-at-a-time walk
+# (identifiers in order, most recent revision first).
+
+import sys,threading
+from multiprocessing.pool import ThreadPool
+
+class PackageWalk:
+
+    # listVersions(pastaScope,pastaId), packageInfo(pastaScope,pastaId,pastaVersion),
+    # metadataUseCount(pastaScope,pastaId,pastaVersion) and
+    # entityAuditCounts(pastaScope,pastaId,pastaVersion,pastaEntity) are the
+    # same functions the reporting scripts call one at a time.
+    # savedResult(pastaId,pastaVersion), if given, returns the result of a
+    # revision finished by an earlier run (see pastaJournal.py) or None
+    def __init__(self,concurrency,listVersions,packageInfo,metadataUseCount,entityAuditCounts,savedResult=None):
+        self.concurrency=concurrency
+        self.savedResult=savedResult
+        self.listVersions=listVersions
+        self.packageInfo=packageInfo
+        self.metadataUseCount=metadataUseCount
+        self.entityAuditCounts=entityAuditCounts
+        self.condition=threading.Condition()
+
+    # Generates one dictionary per package revision with pastaId, pastaVersion,
+    # packageData (from packageInfo), metadataDownloadCount and entityCounts
+    # (entityAuditCounts for each entity, in the order of packageData['entities'])
+    def walk(self,pastaScope,pastaIds):
+        self.pastaScope=pastaScope
+        self.error=None
+        self.versionSlots=[None]*len(pastaIds)
+        self.pool=ThreadPool(self.concurrency)
+        try:
+            idNumber=0
+            for pastaId in pastaIds:
+                self.submit(self.listVersions,(pastaScope,pastaId),self.versionsDone,idNumber,pastaId)
+                idNumber=idNumber+1
+            for idNumber in range(len(pastaIds)):
+                self.waitFor(lambda: self.versionSlots[idNumber] is not None)
+                for packageResult in self.versionSlots[idNumber]:
+                    self.waitFor(lambda: packageResult['pending'] == 0)
+                    del packageResult['pending']
+                    yield(packageResult)
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+
+    def waitFor(self,isReady):
+        with self.condition:
+            while not isReady() and self.error is None:
+                self.condition.wait(1)
+            if self.error is not None:
+                raise self.error[0],self.error[1],self.error[2]
+
+    # run function(*args) on the pool, then handleResult(result,*handlerArgs)
+    def submit(self,function,args,handleResult,*handlerArgs):
+        def runTask():
+            try:
+                handleResult(function(*args),*handlerArgs)
+            except:
+                with self.condition:
+                    if self.error is None:
+                        self.error=sys.exc_info()
+                    self.condition.notify_all()
+        self.pool.apply_async(runTask)
+
+    def versionsDone(self,pastaVersions,idNumber,pastaId):
+        packageResults=[]
+        for pastaVersion in pastaVersions:
+            savedResult=None
+            if self.savedResult is not None:
+                savedResult=self.savedResult(pastaId,pastaVersion)
+            if savedResult is not None:
+                savedResult['pending']=0
+                packageResults.append(savedResult)
+                continue
+            # pending counts the steps still to finish for the package
+            packageResults.append({'pastaId':pastaId,'pastaVersion':pastaVersion,'packageData':None,
+                                   'metadataDownloadCount':None,'entityCounts':None,'pending':2})
+        with self.condition:
+            self.versionSlots[idNumber]=packageResults
+            self.condition.notify_all()
+        for packageResult in packageResults:
+            if packageResult['pending'] == 0:
+                continue
+            self.submit(self.packageInfo,(self.pastaScope,pastaId,packageResult['pastaVersion']),self.packageDone,packageResult)
+            self.submit(self.metadataUseCount,(self.pastaScope,pastaId,packageResult['pastaVersion']),self.metadataDone,packageResult)
+
+    def packageDone(self,packageData,packageResult):
+        entities=packageData['entities']
+        with self.condition:
+            packageResult['packageData']=packageData
+            packageResult['entityCounts']=[None]*len(entities)
+            packageResult['pending']=packageResult['pending']+len(entities)-1
+            self.condition.notify_all()
+        entityNumber=0
+        for (entityName,pastaEntity) in entities:
+            self.submit(self.entityAuditCounts,(self.pastaScope,packageResult['pastaId'],packageResult['pastaVersion'],pastaEntity),self.entityDone,packageResult,entityNumber)
+            entityNumber=entityNumber+1
+
+    def metadataDone(self,metadataCount,packageResult):
+        with self.condition:
+            packageResult['metadataDownloadCount']=metadataCount
+            packageResult['pending']=packageResult['pending']-1
+            self.condition.notify_all()
+
+    def entityDone(self,entityCounts,packageResult,entityNumber):
+        with self.condition:
+            packageResult['entityCounts'][entityNumber]=entityCounts
+            packageResult['pending']=packageResult['pending']-1
+            self.condition.notify_all()
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# Checkpoint journal for long runs of the reporting scripts. The revision
+# list of each identifier and the result of each package revision are
+# written to a local SQLite file as soon as they are finished, so a run
+# that stops part way through a scope can be started again with --resume.
+# Revisions already in the journal are not requested again; their results
+# are read back from the file and the report is built from both.
+#
+# runJournal=RunJournal('run.journal',runParameters,resume)
+# packageResult=runJournal.get(pastaId,pastaVersion)   # None if not finished
+# runJournal.put(pastaId,pastaVersion,packageResult)
+
+import json,sqlite3,threading
+from collections import OrderedDict
+
+# the parameters of the run that wrote a journal, or None if there is none
+def savedParameters(journalFile):
+    db=sqlite3.connect(journalFile)
+    try:
+        row=db.execute('select parameters from run').fetchone()
+    except sqlite3.OperationalError:
+        row=None
+    db.close()
+    if row is None:
+        return(None)
+    return(json.loads(row[0]))
+
+class RunJournal:
+
+    # runParameters is a dictionary of whatever decides the results (script,
+    # scope, period ...). When resuming, a journal written with different
+    # parameters raises ValueError. Without resume the journal is started over
+    def __init__(self,journalFile,runParameters,resume=False):
+        self.journalFile=journalFile
+        self.lock=threading.Lock()
+        self.db=sqlite3.connect(journalFile,check_same_thread=False)
+        self.db.execute('create table if not exists run (parameters text)')
+        self.db.execute('create table if not exists versions (pastaId text primary key, versions text)')
+        self.db.execute('create table if not exists result (pastaId text, pastaVersion text, result text, primary key (pastaId,pastaVersion))')
+        row=self.db.execute('select parameters from run').fetchone()
+        if resume and row is not None and json.loads(row[0]) != runParameters:
+            self.db.close()
+            raise ValueError("journal "+journalFile+" was written by a different run: "+row[0])
+        if not resume or row is None:
+            self.db.execute('delete from run')
+            self.db.execute('delete from versions')
+            self.db.execute('delete from result')
+            self.db.execute('insert into run values (?)',(json.dumps(runParameters,sort_keys=True),))
+        self.db.commit()
+        # (pastaId,pastaVersion) of the results already in the journal
+        self.finished=set((str(pastaId),str(pastaVersion)) for (pastaId,pastaVersion) in self.db.execute('select pastaId,pastaVersion from result'))
+        self.resumedCount=len(self.finished)
+
+    def getVersions(self,pastaId):
+        with self.lock:
+            row=self.db.execute('select versions from versions where pastaId=?',(str(pastaId),)).fetchone()
+        if row is None:
+            return(None)
+        return([str(pastaVersion) for pastaVersion in json.loads(row[0])])
+
+    def putVersions(self,pastaId,pastaVersions):
+        with self.lock:
+            self.db.execute('insert or replace into versions values (?,?)',(str(pastaId),json.dumps(pastaVersions)))
+            self.db.commit()
+
+    # wrap listVersions(pastaScope,pastaId) so that the revision list of
+    # each identifier is requested only once across resumed runs
+    def journaledVersions(self,listVersions):
+        def listJournaledVersions(pastaScope,pastaId):
+            pastaVersions=self.getVersions(pastaId)
+            if pastaVersions is None:
+                pastaVersions=listVersions(pastaScope,pastaId)
+                self.putVersions(pastaId,pastaVersions)
+            return(pastaVersions)
+        return(listJournaledVersions)
+
+    def isFinished(self,pastaId,pastaVersion):
+        return((str(pastaId),str(pastaVersion)) in self.finished)
+
+    def get(self,pastaId,pastaVersion):
+        if not self.isFinished(pastaId,pastaVersion):
+            return(None)
+        with self.lock:
+            row=self.db.execute('select result from result where pastaId=? and pastaVersion=?',(str(pastaId),str(pastaVersion))).fetchone()
+        # dictionaries come back in the order they were written, so that
+        # ties in sorted output (e.g. users with the same count) stay the same
+        return(json.loads(row[0],object_pairs_hook=OrderedDict))
+
+    # the result is committed before put returns, so it survives a crash
+    # right after. Results already in the journal are not written again
+    def put(self,pastaId,pastaVersion,result):
+        if self.isFinished(pastaId,pastaVersion):
+            return
+        with self.lock:
+            self.db.execute('insert or replace into result values (?,?,?)',(str(pastaId),str(pastaVersion),json.dumps(result)))
+            self.db.commit()
+            self.finished.add((str(pastaId),str(pastaVersion)))
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
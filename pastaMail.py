@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# Sends the report emails of PASTAsummary.py over SMTP. Messages are built
+# in memory (a text part and the HTML report as an attachment) and sent by
+# a few threads, each keeping one SMTP connection open for a batch of
+# messages. A message that fails because of a dropped connection or a
+# temporary (4xx) SMTP error is tried again after a growing wait. Each
+# message is counted in pastaStats.runStats as a request to the smtp endpoint.
+#
+# sender=MailSender('localhost')
+# sender.send(fromAddress,toAddress,message)   # returns at once
+# failures=sender.close()                      # waits for all messages
+
+import sys,socket,time,random,threading,smtplib,Queue
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formatdate,make_msgid
+import pastaStats
+
+DEBUG=0
+
+def buildMessage(fromAddress,toAddress,subject,messageText,attachmentName,attachmentHtml):
+    message=MIMEMultipart()
+    message['From']=fromAddress
+    message['To']=toAddress
+    message['Subject']=subject
+    message['Date']=formatdate(localtime=True)
+    message['Message-ID']=make_msgid()
+    message.attach(MIMEText(messageText,'plain'))
+    attachment=MIMEText(attachmentHtml,'html')
+    attachment.add_header('Content-Disposition','attachment',filename=attachmentName)
+    message.attach(attachment)
+    return(message)
+
+# smtpServer may be host or host:port
+def splitServer(smtpServer):
+    if ':' in smtpServer:
+        (smtpHost,smtpPort)=smtpServer.rsplit(':',1)
+        return((smtpHost,int(smtpPort)))
+    return((smtpServer,25))
+
+class MailSender:
+
+    # connections threads each keep one SMTP connection, which is closed
+    # and opened again after batchSize messages
+    def __init__(self,smtpServer,connections=2,batchSize=50,retries=3,backoff=2.0,timeOut=60,userName='',password='',startTls=False):
+        (self.smtpHost,self.smtpPort)=splitServer(smtpServer)
+        self.batchSize=batchSize
+        self.retries=retries
+        self.backoff=backoff
+        self.timeOut=timeOut
+        self.userName=userName
+        self.password=password
+        self.startTls=startTls
+        self.messages=Queue.Queue(connections*batchSize)
+        self.lock=threading.Lock()
+        # (toAddress,error) of the messages that could not be sent
+        self.failures=[]
+        self.sentCount=0
+        self.threads=[]
+        for threadNumber in range(connections):
+            senderThread=threading.Thread(target=self.run)
+            senderThread.daemon=True
+            senderThread.start()
+            self.threads.append(senderThread)
+
+    def send(self,fromAddress,toAddress,message):
+        self.messages.put((fromAddress,toAddress,message))
+
+    # wait for all the messages to be sent and return the failures
+    def close(self):
+        for senderThread in self.threads:
+            self.messages.put(None)
+        for senderThread in self.threads:
+            senderThread.join()
+        return(self.failures)
+
+    def connect(self):
+        smtp=smtplib.SMTP(self.smtpHost,self.smtpPort,timeout=self.timeOut)
+        try:
+            if self.startTls:
+                smtp.starttls()
+            if self.userName != '':
+                smtp.login(self.userName,self.password)
+        except:
+            smtp.close()
+            raise
+        return(smtp)
+
+    def disconnect(self,smtp):
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException,socket.error):
+            smtp.close()
+
+    def run(self):
+        smtp=None
+        batchCount=0
+        while True:
+            mailItem=self.messages.get()
+            if mailItem is None:
+                break
+            (fromAddress,toAddress,message)=mailItem
+            messageString=None
+            attempt=0
+            while True:
+                startTime=time.time()
+                try:
+                    if messageString is None:
+                        messageString=message.as_string()
+                    if smtp is None:
+                        smtp=self.connect()
+                        batchCount=0
+                    smtp.sendmail(fromAddress,[toAddress],messageString)
+                    pastaStats.runStats.recordRequest('smtp',time.time()-startTime)
+                    pastaStats.runStats.addBytes('smtp',len(messageString))
+                    batchCount=batchCount+1
+                    with self.lock:
+                        self.sentCount=self.sentCount+1
+                    if DEBUG:
+                        sys.stderr.write("sent report to "+toAddress+"\n")
+                    break
+                except (smtplib.SMTPServerDisconnected,smtplib.SMTPConnectError,socket.error),e:
+                    # the connection is gone, so open a new one for the next try
+                    if smtp is not None:
+                        smtp.close()
+                        smtp=None
+                    if isinstance(e,socket.timeout):
+                        pastaStats.runStats.recordTimeout('smtp')
+                    temporary=True
+                except smtplib.SMTPRecipientsRefused,e:
+                    temporary=all(code >= 400 and code < 500 for (code,msg) in e.recipients.values())
+                except smtplib.SMTPResponseException,e:
+                    temporary=e.smtp_code >= 400 and e.smtp_code < 500
+                    # smtp is None when connecting failed, e.g. a refused login
+                    if smtp is not None:
+                        try:
+                            smtp.rset()
+                        except (smtplib.SMTPException,socket.error):
+                            smtp.close()
+                            smtp=None
+                except smtplib.SMTPException,e:
+                    temporary=False
+                except Exception,e:
+                    # anything else fails this message only, so the queue keeps
+                    # draining and send and close never wait on a dead thread
+                    temporary=False
+                    if smtp is not None:
+                        try:
+                            smtp.close()
+                        except Exception:
+                            pass
+                        smtp=None
+                if not temporary or attempt >= self.retries:
+                    sys.stderr.write("could not send report to "+toAddress+": "+str(e)+"\n")
+                    with self.lock:
+                        self.failures.append((toAddress,str(e)))
+                    pastaStats.runStats.recordError('smtp')
+                    break
+                pastaStats.runStats.recordRetry('smtp')
+                delay=self.backoff*(2**attempt)
+                delay=delay/2+random.uniform(0,delay/2)
+                sys.stderr.write("Retrying email to "+toAddress+" ("+str(e)+") in "+"%.1f"%delay+" seconds\n")
+                time.sleep(delay)
+                attempt=attempt+1
+            if smtp is not None and batchCount >= self.batchSize:
+                self.disconnect(smtp)
+                smtp=None
+        if smtp is not None:
+            self.disconnect(smtp)
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+# Plans which package revisions of a scope are looked up in full. With the
+# audit records of the whole scope for the period at hand (a ScopeAudit or
+# AuditStore from pastaAudit.py) the revisions without a single audit
+# record are known before the walk starts. All their counts are 0, so
+# their EML, entity list and audit reports are not requested, and an
+# identifier with no such revision is skipped without listing its
+# revisions. The skips are kept so the scripts can report them.
+#
+# revisionPlan=RevisionPlan(pastaScope,scopeAudit.activeRevisions())
+# listVersions=revisionPlan.plannedVersions(listVersions)
+
+import threading
+
+class RevisionPlan:
+
+    # activeRevisions is a set of (pastaId,pastaVersion) strings
+    def __init__(self,pastaScope,activeRevisions):
+        self.pastaScope=pastaScope
+        self.activeRevisions=activeRevisions
+        self.activeIds=set(pastaId for (pastaId,pastaVersion) in activeRevisions)
+        self.lock=threading.Lock()
+        self.queriedCount=0
+        # (pastaId,pastaVersion) skipped, with pastaVersion '' when all the
+        # revisions of an identifier were skipped
+        self.skipped=[]
+
+    def queryIdentifier(self,pastaId):
+        if str(pastaId) in self.activeIds:
+            return(True)
+        with self.lock:
+            self.skipped.append((str(pastaId),''))
+        return(False)
+
+    def queryRevision(self,pastaId,pastaVersion):
+        with self.lock:
+            if (str(pastaId),str(pastaVersion)) in self.activeRevisions:
+                self.queriedCount=self.queriedCount+1
+                return(True)
+            self.skipped.append((str(pastaId),str(pastaVersion)))
+        return(False)
+
+    # wrap listVersions(pastaScope,pastaId) so that only the revisions to
+    # look up are listed
+    def plannedVersions(self,listVersions):
+        def listPlannedVersions(pastaScope,pastaId):
+            if not self.queryIdentifier(pastaId):
+                return([])
+            return([pastaVersion for pastaVersion in listVersions(pastaScope,pastaId) if self.queryRevision(pastaId,pastaVersion)])
+        return(listPlannedVersions)
+
+    # packageIds of the skips in report order: identifiers in order, most
+    # recent revision first. A whole identifier is given as scope.identifier
+    def skippedPackageIds(self):
+        def reportOrder(skip):
+            (pastaId,pastaVersion)=skip
+            if pastaVersion == '':
+                return((int(pastaId),0))
+            return((int(pastaId),-int(pastaVersion)))
+        packageIds=[]
+        with self.lock:
+            for (pastaId,pastaVersion) in sorted(self.skipped,key=reportOrder):
+                if pastaVersion == '':
+                    packageIds.append(self.pastaScope+"."+pastaId)
+                else:
+                    packageIds.append(self.pastaScope+"."+pastaId+"."+pastaVersion)
+        return(packageIds)
+
+    def summary(self):
+        with self.lock:
+            return({'activeRevisions':len(self.activeRevisions),
+                    'queriedRevisions':self.queriedCount,
+                    'skippedIdentifiers':len([pastaVersion for (pastaId,pastaVersion) in self.skipped if pastaVersion == '']),
+                    'skippedRevisions':len([pastaVersion for (pastaId,pastaVersion) in self.skipped if pastaVersion != ''])})
+
+    def summaryMessage(self):
+        planSummary=self.summary()
+        return(str(planSummary['queriedRevisions'])+" package revisions looked up, "+str(planSummary['skippedIdentifiers'])+" identifiers and "+
+               str(planSummary['skippedRevisions'])+" other revisions skipped with no audit records in the period\n")
@@ -0,0 +1,216 @@
+#!/usr/bin/python
+# Counts and timings for one run of a reporting script. pastaClient records
+# each request under the kind of PASTA endpoint it went to (package lists,
+# revision lists, metadata, entity lists, audit reports ...) with its time
+# to the response headers, the bytes of the body and the time spent reading
+# them, and any retries, timeouts or errors.
+# pastaMail records the messages it sends the same way. The scripts time
+# the steps of a run (listing, metadata, audit, render, deliver) and write
+# everything as JSON at the end.
+#
+# with pastaStats.phase('render'):
+#     ...
+# walkTimer=pastaStats.phase('walk').start()
+# ...
+# walkTimer.stop()
+# loadPackage=pastaStats.timed('metadata',loadPackage)
+# pastaStats.writeSummary('stats.json')
+
+import sys,time,math,threading,json,urlparse
+
+# kind of endpoint of a url, from the start of its path
+def endpointClass(url):
+    pathParts=[pathPart for pathPart in urlparse.urlsplit(url).path.split('/') if pathPart != '']
+    if pathParts[:2] == ['package','eml']:
+        if len(pathParts) <= 3:
+            return('packageList')
+        if len(pathParts) == 4:
+            return('revisionList')
+        return('packageExists')
+    if pathParts[:3] == ['package','metadata','eml']:
+        return('metadata')
+    if pathParts[:3] == ['package','data','eml']:
+        return('entityList')
+    if pathParts[:2] == ['audit','report']:
+        return('audit')
+    return('other')
+
+# command line options whose values are not written to the summary
+secretOptions=['--password','-p']
+
+# the arguments of a script with the values of secretOptions replaced.
+# argparse also takes --password=secret, a prefix such as --pass, and
+# -psecret or -qpsecret, so those are covered too. A value that only
+# looks like one of them is replaced as well, which does no harm
+def redactedArguments(arguments):
+    redacted=[]
+    redactNext=False
+    for argument in arguments:
+        if redactNext:
+            redacted.append('***')
+            redactNext=False
+            continue
+        if argument.startswith('--'):
+            optionName=argument.split('=',1)[0]
+            if len(optionName) > 2 and [secretOption for secretOption in secretOptions if secretOption.startswith(optionName)]:
+                if '=' in argument:
+                    argument=optionName+'=***'
+                else:
+                    redactNext=True
+        elif argument.startswith('-') and len(argument) > 1:
+            for secretOption in secretOptions:
+                if len(secretOption) == 2 and secretOption[1] in argument[1:]:
+                    optionEnd=argument.index(secretOption[1],1)+1
+                    if optionEnd == len(argument):
+                        redactNext=True
+                    else:
+                        argument=argument[:optionEnd]+'***'
+                    break
+        redacted.append(argument)
+    return(redacted)
+
+# nearest-rank percentile of a sorted list
+def percentile(sortedValues,percent):
+    if not sortedValues:
+        return(None)
+    rank=int(math.ceil(percent/100.0*len(sortedValues)))
+    return(sortedValues[max(rank,1)-1])
+
+class RunStats:
+
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.startTime=time.time()
+        self.endpoints={}
+        self.phases={}
+        # other parts of the summary, e.g. the plan of the run (see pastaPlan.py)
+        self.sections={}
+
+    def endpoint(self,endpointName):
+        endpointStats=self.endpoints.get(endpointName)
+        if endpointStats is None:
+            endpointStats={'requests':0,'errors':0,'retries':0,'timeouts':0,'bytes':0,'readSeconds':0.0,'latencies':[]}
+            self.endpoints[endpointName]=endpointStats
+        return(endpointStats)
+
+    # one request answered by the server, seconds after it was sent
+    def recordRequest(self,endpointName,seconds):
+        with self.lock:
+            endpointStats=self.endpoint(endpointName)
+            endpointStats['requests']=endpointStats['requests']+1
+            endpointStats['latencies'].append(seconds)
+
+    def recordRetry(self,endpointName):
+        with self.lock:
+            endpointStats=self.endpoint(endpointName)
+            endpointStats['retries']=endpointStats['retries']+1
+
+    def recordTimeout(self,endpointName):
+        with self.lock:
+            endpointStats=self.endpoint(endpointName)
+            endpointStats['timeouts']=endpointStats['timeouts']+1
+
+    # a request given up on, after any retries
+    def recordError(self,endpointName):
+        with self.lock:
+            endpointStats=self.endpoint(endpointName)
+            endpointStats['errors']=endpointStats['errors']+1
+
+    def addBytes(self,endpointName,byteCount,seconds=0.0):
+        with self.lock:
+            endpointStats=self.endpoint(endpointName)
+            endpointStats['bytes']=endpointStats['bytes']+byteCount
+            endpointStats['readSeconds']=endpointStats['readSeconds']+seconds
+
+    def addPhaseTime(self,phaseName,seconds):
+        with self.lock:
+            phaseStats=self.phases.setdefault(phaseName,{'calls':0,'seconds':0.0})
+            phaseStats['calls']=phaseStats['calls']+1
+            phaseStats['seconds']=phaseStats['seconds']+seconds
+
+    def addSection(self,sectionName,section):
+        with self.lock:
+            self.sections[sectionName]=section
+
+    def phase(self,phaseName):
+        return(PhaseTimer(self,phaseName))
+
+    # wrap a function so that the time spent in each call is added to a
+    # phase. When the function is called by many threads at once the
+    # seconds of the phase are summed over them and can be more than the
+    # wall time of the run
+    def timed(self,phaseName,function):
+        def timedFunction(*args):
+            startTime=time.time()
+            try:
+                return(function(*args))
+            finally:
+                self.addPhaseTime(phaseName,time.time()-startTime)
+        return(timedFunction)
+
+    def summary(self):
+        with self.lock:
+            endpointSummaries={}
+            for (endpointName,endpointStats) in self.endpoints.items():
+                latencies=sorted(endpointStats['latencies'])
+                endpointSummary=dict((statName,endpointStats[statName]) for statName in ('requests','errors','retries','timeouts','bytes','readSeconds'))
+                endpointSummary['seconds']=sum(latencies)
+                endpointSummary['p50']=percentile(latencies,50)
+                endpointSummary['p95']=percentile(latencies,95)
+                endpointSummary['p99']=percentile(latencies,99)
+                endpointSummary['max']=latencies[-1] if latencies else None
+                endpointSummaries[endpointName]=endpointSummary
+            phaseSummaries=dict((phaseName,dict(phaseStats)) for (phaseName,phaseStats) in self.phases.items())
+            runSummary=dict(self.sections)
+        runSummary.update({'script':sys.argv[0],
+                'arguments':redactedArguments(sys.argv[1:]),
+                'startTime':time.strftime("%Y-%m-%dT%H:%M:%S",time.localtime(self.startTime)),
+                'wallSeconds':time.time()-self.startTime,
+                'endpoints':endpointSummaries,
+                'phases':phaseSummaries})
+        return(runSummary)
+
+    # write the summary to fileName, or to stderr if fileName is -
+    def writeSummary(self,fileName):
+        if fileName == '-':
+            json.dump(self.summary(),sys.stderr,indent=2,sort_keys=True)
+            sys.stderr.write("\n")
+            return
+        statsOut=open(fileName,'w')
+        json.dump(self.summary(),statsOut,indent=2,sort_keys=True)
+        statsOut.close()
+
+class PhaseTimer:
+
+    def __init__(self,runStats,phaseName):
+        self.runStats=runStats
+        self.phaseName=phaseName
+
+    def start(self):
+        self.startTime=time.time()
+        return(self)
+
+    def stop(self):
+        self.runStats.addPhaseTime(self.phaseName,time.time()-self.startTime)
+
+    def __enter__(self):
+        return(self.start())
+
+    def __exit__(self,excType,excValue,traceBack):
+        self.stop()
+        return(False)
+
+# stats shared by everything in one run of a script
+runStats=RunStats()
+
+def phase(phaseName):
+    return(runStats.phase(phaseName))
+
+def timed(phaseName,function):
+    return(runStats.timed(phaseName,function))
+
+def addSection(sectionName,section):
+    runStats.addSection(sectionName,section)
+
+def writeSummary(fileName):
+    runStats.writeSummary(fileName)